@@ -1,23 +1,128 @@
+from collections import OrderedDict
+import functools
+import hashlib
+import os
 import numpy as np
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
-from models.inference import *
-from PIL import Image
-from torchcam.utils import overlay_mask
-
-
-def draw_CAM(img, cam):
-    # convert cam to PIL image
-    cam = Image.fromarray(cam)
-    return overlay_mask(img, cam, alpha=0.5)
+from models.base import BaseBackendModel
+
+
+def jetLUT():
+    # matplotlib's 'jet' segments sampled at 256 levels, as used by torchcam.utils.overlay_mask
+    segments = {
+        'red': ((0.0, 0), (0.35, 0), (0.66, 1), (0.89, 1), (1.0, 0.5)),
+        'green': ((0.0, 0), (0.125, 0), (0.375, 1), (0.64, 1), (0.91, 0), (1.0, 0)),
+        'blue': ((0.0, 0.5), (0.11, 1), (0.34, 1), (0.65, 0), (1.0, 0)),
+    }
+    x = np.linspace(0, 1, 256)
+    return np.stack([(np.interp(x, *zip(*segments[color])) * 255).astype(np.uint32) for color in ['red', 'green', 'blue']], axis=1)
+
+
+JET_LUT = jetLUT()
+
+
+@functools.lru_cache(maxsize=8)
+def blendLUTs(weight):
+    # Colormap premultiplied by the overlay weight and packed as 0xAARRGGBB like
+    # QImage.Format_RGB32, plus the per-byte scale for the image. The two scaled
+    # bytes never sum above 255, so blending is a plain uint32 addition.
+    red, green, blue = ((JET_LUT * (256 - weight)) >> 8).T
+    alpha = 255 - ((255 * weight) >> 8)
+    overlay = (np.uint32(alpha) << 24) | (red << 16) | (green << 8) | blue
+    return overlay, ((np.arange(256) * weight) >> 8).astype(np.uint8)
+
+
+def interpolationMatrix(inSize, outSize):
+    # linear interpolation weights with pixel-centre alignment, one row per output pixel
+    x = np.clip((np.arange(outSize, dtype=np.float32) + 0.5) * inSize / outSize - 0.5, 0, inSize - 1)
+    x0 = x.astype(np.int64)
+    x1 = np.minimum(x0 + 1, inSize - 1)
+    matrix = np.zeros((outSize, inSize), dtype=np.float32)
+    matrix[np.arange(outSize), x0] += 1 - (x - x0)
+    matrix[np.arange(outSize), x1] += x - x0
+    return matrix
+
+
+def resizeBilinear(cam, height, width):
+    # separable bilinear resize as two small matrix products
+    cam = np.asarray(cam, dtype=np.float32)
+    return interpolationMatrix(cam.shape[0], height) @ cam @ interpolationMatrix(cam.shape[1], width).T
+
+
+def overlayCAM(pixels, cam, alpha=0.5):
+    # pixels: (H, W) uint32 in QImage.Format_RGB32 layout, blended in place.
+    # Same colouring as overlay_mask: cam**2 through the jet LUT.
+    weight = int(round(alpha * 256))
+    overlay, scale = blendLUTs(weight)
+    cam = resizeBilinear(cam, *pixels.shape)
+    cam *= cam
+    cam *= 256
+    np.clip(cam, 0, 255, out=cam)
+    if weight == 128:
+        pixels >>= 1
+        pixels &= 0x7f7f7f7f
+    else:
+        channels = pixels.view(np.uint8)
+        channels[...] = scale[channels]
+    pixels += overlay[cam.astype(np.uint8)]
+
+
+def renderImage(imgPath, cam, width, height):
+    # decode straight to the smaller of source and display resolution and colour
+    # the CAM there, without any PIL round trip
+    reader = QImageReader(imgPath)
+    imgSize = reader.size()
+    displaySize = imgSize.scaled(width, height, Qt.KeepAspectRatio) if imgSize.isValid() else None
+    if displaySize is not None and displaySize.width() < imgSize.width():
+        reader.setScaledSize(displaySize)
+    img = reader.read()
+    if img.isNull():
+        raise OSError(f'cannot read image {imgPath}: {reader.errorString()}')
+    if cam is not None:
+        img = img.convertToFormat(QImage.Format_RGB32)
+        ptr = img.bits()
+        ptr.setsize(img.height() * img.bytesPerLine())
+        pixels = np.frombuffer(ptr, dtype=np.uint32).reshape(img.height(), img.bytesPerLine() // 4)[:, :img.width()]
+        overlayCAM(pixels, cam)
+    if img.width() != width and img.height() != height:
+        img = img.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return img
+
+
+class RenderTask(QRunnable):
+
+    def __init__(self, key, imgPath, cam, rendered):
+        super().__init__()
+        self.key = key
+        self.imgPath = imgPath
+        self.cam = cam
+        self.rendered = rendered
+
+
+    def run(self):
+        try:
+            img = renderImage(self.imgPath, self.cam, self.key[2], self.key[3])
+        except OSError:
+            img = QImage()
+        self.rendered.emit(self.key, img)
 
 
 class ImageViewer(QLabel):
 
-    def __init__(self, parent):
+    rendered = pyqtSignal(object, QImage)
+
+    def __init__(self, parent, capacity=24):
         super().__init__(parent)
         self.parent = parent
+        self.capacity = capacity
+        # rendered pixmaps keyed by (path, CAM mode, viewer width, viewer height)
+        self._pixmaps = OrderedDict()
+        self._pending = set()
+        self._threadPool = QThreadPool(self)
+        self._threadPool.setMaxThreadCount(2)
+        self.rendered.connect(self._rendered)
         self._initUI()
 
 
@@ -33,13 +138,53 @@ class ImageViewer(QLabel):
         self.setText("Image Viewer")
 
 
-    def setImage(self, img_path, cam = None):
-        img = Image.open(img_path).convert('RGB')
-        if cam is not None:
-            img = draw_CAM(img, cam)
-        img = img.toqimage()
-        img = img.scaled(self.width(), self.height(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        self.setPixmap(QPixmap.fromImage(img))
+    def _key(self, img_path, cam, camMode):
+        return (img_path, camMode if cam is not None else 0, self.width(), self.height())
+
+
+    def _cachePixmap(self, key, pixmap):
+        self._pixmaps[key] = pixmap
+        self._pixmaps.move_to_end(key)
+        if len(self._pixmaps) > self.capacity:
+            self._pixmaps.popitem(last=False)
+
+
+    def setImage(self, img_path, cam = None, camMode = 0):
+        key = self._key(img_path, cam, camMode)
+        if key in self._pixmaps:
+            self._pixmaps.move_to_end(key)
+        else:
+            try:
+                img = renderImage(img_path, cam, self.width(), self.height())
+            except OSError:
+                # e.g. an image marked failed, nothing is cached so it is tried again next time
+                self.setText(f'Cannot display {os.path.basename(img_path)}')
+                return
+            self._cachePixmap(key, QPixmap.fromImage(img))
+        self.setPixmap(self._pixmaps[key])
+
+
+    def prefetch(self, items):
+        # items: (img_path, cam, camMode), rendered in the background so that
+        # moving to a neighbouring image only has to swap pixmaps
+        for img_path, cam, camMode in items:
+            key = self._key(img_path, cam, camMode)
+            if key in self._pixmaps or key in self._pending:
+                continue
+            self._pending.add(key)
+            self._threadPool.start(RenderTask(key, img_path, cam, self.rendered))
+
+
+    def _rendered(self, key, img):
+        self._pending.discard(key)
+        if not img.isNull() and key not in self._pixmaps:
+            self._cachePixmap(key, QPixmap.fromImage(img))
+
+
+    def clearCache(self):
+        self._threadPool.clear()
+        self._pixmaps.clear()
+        self._pending.clear()
 
 
 class IconTextButton(QPushButton):
@@ -101,7 +246,7 @@ class PredictionGroupBox(BaseResultGroupBox):
     def updatePredictionIndex(self, tumorClassId, tumorTypeId):
         tumorClass = BaseBackendModel.get_label('binary', tumorClassId)
         tumorType = BaseBackendModel.get_label('subtype', tumorTypeId)
-        self._updatePrediction(tumorClass, tumorType, BackendModel.checkConflict(tumorClassId, tumorTypeId))
+        self._updatePrediction(tumorClass, tumorType, BaseBackendModel.checkConflict(tumorClassId, tumorTypeId))
 
 
     def _updatePrediction(self, tumorClass, tumorType, conflict=False):
@@ -219,27 +364,204 @@ class ProbabilityGroupBox(BaseResultGroupBox):
             self.layout().addWidget(self._valueSliders[key])
 
 
-class ImageTableWidget(QTableWidget):
+class ThumbnailTask(QRunnable):
+
+    def __init__(self, imgPath, cacheDir, size, loaded):
+        super().__init__()
+        self.imgPath = imgPath
+        self.cacheDir = cacheDir
+        self.size = size
+        self.loaded = loaded
+
+
+    def run(self):
+        # QImage (unlike QPixmap) is safe to use outside the GUI thread
+        try:
+            key = f'{os.path.abspath(self.imgPath)}:{os.stat(self.imgPath).st_mtime_ns}'
+        except OSError:
+            self.loaded.emit(self.imgPath, QImage())
+            return
+        cachePath = os.path.join(self.cacheDir, hashlib.sha1(key.encode()).hexdigest() + '.png')
+        img = QImage(cachePath)
+        if img.isNull():
+            reader = QImageReader(self.imgPath)
+            imgSize = reader.size()
+            if imgSize.isValid():
+                # lets the JPEG decoder skip most of the full-resolution work
+                reader.setScaledSize(imgSize.scaled(self.size, self.size, Qt.KeepAspectRatio))
+            img = reader.read()
+            if not img.isNull():
+                img.save(cachePath)
+        self.loaded.emit(self.imgPath, img)
+
+
+class ThumbnailCache(QObject):
+
+    loaded = pyqtSignal(str, QImage)
+    updated = pyqtSignal(str)
+
+    def __init__(self, parent, cacheDir='./cache/thumbnails', size=100, capacity=2000):
+        super().__init__(parent)
+        self.cacheDir = cacheDir
+        self.size = size
+        self.capacity = capacity
+        self._pixmaps = OrderedDict()
+        self._pending = set()
+        self._threadPool = QThreadPool(self)
+        os.makedirs(cacheDir, exist_ok=True)
+        self.loaded.connect(self._loaded)
+
+
+    def get(self, imgPath):
+        if imgPath in self._pixmaps:
+            self._pixmaps.move_to_end(imgPath)
+            return self._pixmaps[imgPath]
+        if imgPath not in self._pending:
+            self._pending.add(imgPath)
+            self._threadPool.start(ThumbnailTask(imgPath, self.cacheDir, self.size, self.loaded))
+        return None
+
+
+    def _loaded(self, imgPath, img):
+        self._pending.discard(imgPath)
+        self._pixmaps[imgPath] = QPixmap.fromImage(img.scaled(self.size, self.size, Qt.KeepAspectRatio, Qt.SmoothTransformation)) if not img.isNull() else QPixmap()
+        if len(self._pixmaps) > self.capacity:
+            # evicted thumbnails come back quickly from the disk cache
+            self._pixmaps.popitem(last=False)
+        self.updated.emit(imgPath)
+
+
+    def clear(self):
+        self._threadPool.clear()
+        self._pixmaps.clear()
+        self._pending.clear()
+
+
+class ImageTableModel(QAbstractTableModel):
+
+    def __init__(self, parent, thumbnails):
+        super().__init__(parent)
+        self._headers = ['Image', 'Path', 'Class', 'Type']
+        self._paths = []
+        self._pathToRow = {}
+        self._labels = []
+        self._thumbnails = thumbnails
+        self._thumbnails.updated.connect(self._thumbnailUpdated)
+
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._paths)
+
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
+
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self._headers[section]
+        return None
+
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        if column == 0:
+            # only rows being painted ask for their thumbnail
+            return self._thumbnails.get(self._paths[row]) if role == Qt.DecorationRole else None
+        if role == Qt.DisplayRole:
+            if column == 1:
+                return self._paths[row]
+            return self._labels[row][column - 2]
+        if role == Qt.BackgroundRole and self._labels[row][2]:
+            return QColor(255, 0, 0, 50)
+        return None
+
+
+    def path(self, row):
+        return self._paths[row]
+
+
+    def row(self, imgPath):
+        return self._pathToRow.get(imgPath)
+
+
+    def addPaths(self, imgPaths):
+        imgPaths = [imgPath for imgPath in imgPaths if imgPath not in self._pathToRow]
+        if len(imgPaths) == 0:
+            return
+        self.beginInsertRows(QModelIndex(), len(self._paths), len(self._paths) + len(imgPaths) - 1)
+        for imgPath in imgPaths:
+            self._pathToRow[imgPath] = len(self._paths)
+            self._paths.append(imgPath)
+            self._labels.append(['', '', False])
+        self.endInsertRows()
+
+
+    def setLabels(self, updates):
+        rows = []
+        for imgPath, labels in updates.items():
+            row = self._pathToRow.get(imgPath)
+            if row is None:
+                continue
+            self._labels[row] = labels
+            rows.append(row)
+        if rows:
+            self.dataChanged.emit(self.index(min(rows), 1), self.index(max(rows), self.columnCount() - 1))
+
+
+    def _thumbnailUpdated(self, imgPath):
+        row = self._pathToRow.get(imgPath)
+        if row is not None:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, 0), [Qt.DecorationRole])
+
+
+    def clear(self):
+        self.beginResetModel()
+        self._paths = []
+        self._pathToRow = {}
+        self._labels = []
+        self.endResetModel()
+
+
+class ThumbnailDelegate(QStyledItemDelegate):
+
+    def paint(self, painter, option, index):
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+        pixmap = index.data(Qt.DecorationRole)
+        if pixmap is None or pixmap.isNull():
+            return
+        x = option.rect.x() + (option.rect.width() - pixmap.width()) // 2
+        y = option.rect.y() + (option.rect.height() - pixmap.height()) // 2
+        painter.drawPixmap(x, y, pixmap)
+
+
+class ImageTableWidget(QTableView):
         
     imported = pyqtSignal(list)
+    itemSelectionChanged = pyqtSignal()
     
     def __init__(self, parent):
         super().__init__(parent)
         self.parent = parent
-        self._pathToRow = {}
+        self._thumbnails = ThumbnailCache(self)
+        self._model = ImageTableModel(self, self._thumbnails)
+        self.setModel(self._model)
+        self.setItemDelegateForColumn(0, ThumbnailDelegate(self))
         self._initUI()
         self.setAcceptDrops(True)
 
         self.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.selectionModel().selectionChanged.connect(lambda selected, deselected: self.itemSelectionChanged.emit())
 
 
     def _initUI(self):
         self.setFixedWidth(400)
         self.verticalHeader().setVisible(False)
-        self.setColumnCount(4)
-        self.setHorizontalHeaderLabels(['Image', 'Path', 'Class', 'Type'])
         self.horizontalHeader().setSectionResizeMode(0, QHeaderView.Fixed)
         self.setColumnWidth(0, 120)
         self.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
@@ -247,7 +569,9 @@ class ImageTableWidget(QTableWidget):
         self.setColumnWidth(2, 50)
         self.horizontalHeader().setSectionResizeMode(3, QHeaderView.Fixed)
         self.setColumnWidth(3, 50)
-        self.verticalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        # fixed row height, ResizeToContents would have to measure every row
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setDefaultSectionSize(self._thumbnails.size + 4)
 
 
     def dragEnterEvent(self, event):
@@ -276,54 +600,100 @@ class ImageTableWidget(QTableWidget):
     
 
     def addImage(self, imgPath):
-        row = self.rowCount()
-        self.insertRow(row)
-        self._pathToRow[imgPath] = row
-        imgLabel = QLabel()
-        imgLabel.setPixmap(QPixmap(imgPath).scaled(100, 100, Qt.KeepAspectRatio, Qt.SmoothTransformation))
-        imgLabel.setAlignment(Qt.AlignCenter)
-        self.setCellWidget(row, 0, imgLabel)
-        self.setItem(row, 1, QTableWidgetItem(imgPath))
+        self._model.addPaths([imgPath])
 
     
     def addImages(self, imgPaths):
-        for imgPath in imgPaths:
-            self.addImage(imgPath)
+        self._model.addPaths(imgPaths)
 
 
     def selectImageByPath(self, imgPath):
-        self.selectRow(self._pathToRow[imgPath])
+        row = self._model.row(imgPath)
+        self.selectRow(row)
+        self.scrollTo(self._model.index(row, 0))
+
+
+    def neighbourPaths(self, imgPath, distance=1):
+        row = self._model.row(imgPath)
+        if row is None:
+            return []
+        rows = [r for i in range(1, distance + 1) for r in (row + i, row - i)]
+        return [self._model.path(r) for r in rows if 0 <= r < self._model.rowCount()]
+
+
+    def visiblePaths(self):
+        first = self.rowAt(0)
+        if first < 0:
+            return []
+        last = self.rowAt(self.viewport().height() - 1)
+        last = self._model.rowCount() - 1 if last < 0 else last
+        return [self._model.path(row) for row in range(first, last + 1)]
 
 
     def getSelectedImagePath(self):
-        if self.selectedItems():
-            row = self.selectedItems()[0].row()
-            return self.item(row, 1).text()
+        rows = self.selectionModel().selectedRows()
+        if rows:
+            return self._model.path(rows[0].row())
         else:
             return None
         
     
     def updateResult(self, results):
+        updates = {}
         for imgPath in results.keys():
-            if not imgPath in self._pathToRow.keys():
+            if results[imgPath].get('error'):
+                updates[imgPath] = ['failed', 'failed', True]
                 continue
-            i = self._pathToRow[imgPath]
             tumorClassId = results[imgPath]['pred']['binary']
             tumorTypeId = results[imgPath]['pred']['subtype']
             tumorClass = BaseBackendModel.get_label('binary', tumorClassId, abbrev=True)
             tumorType = BaseBackendModel.get_label('subtype', tumorTypeId, abbrev=True)
-            self.setItem(i, 2, QTableWidgetItem(tumorClass))
-            self.setItem(i, 3, QTableWidgetItem(tumorType))
-            if tumorClass == 'reject' or tumorType == 'reject' or BaseBackendModel.checkConflict(tumorClassId, tumorTypeId):
-                for j in range(1, self.columnCount()):
-                    self.item(i, j).setBackground(QColor(255, 0, 0, 50))
-            else:
-                for j in range(1, self.columnCount()):
-                    self.item(i, j).setBackground(QColor(255, 255, 255, 0))
+            flagged = tumorClass == 'reject' or tumorType == 'reject' or BaseBackendModel.checkConflict(tumorClassId, tumorTypeId)
+            updates[imgPath] = [tumorClass, tumorType, flagged]
+        self._model.setLabels(updates)
     
 
-    def reset(self):
-        self._pathToRow = {}
-        for _ in range(self.rowCount()):
-            self.removeRow(0)
-            
\ No newline at end of file
+    def clearImages(self):
+        self._thumbnails.clear()
+        self._model.clear()
+
+
+class StatsPanel(QWidget):
+    # Live view of a backend's metrics snapshot (models/metrics.py), one row
+    # per timed stage followed by the counters and queue depths.
+
+    columns = ['count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms']
+
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.Tool)
+        self._table = QTableWidget(self)
+        self._countersLabel = QLabel(self)
+        self._initUI()
+
+
+    def _initUI(self):
+        self.setWindowTitle('Inference statistics')
+        self.resize(620, 420)
+        self._table.setColumnCount(len(self.columns))
+        self._table.setHorizontalHeaderLabels([column.replace('_ms', ' (ms)') for column in self.columns])
+        self._table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self._table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self._countersLabel.setFont(QFont("Arial", 10))
+        self._countersLabel.setWordWrap(True)
+        self.setLayout(QVBoxLayout())
+        self.layout().addWidget(self._table)
+        self.layout().addWidget(self._countersLabel)
+
+
+    def updateStats(self, snapshot):
+        timers = snapshot['timers']
+        self._table.setRowCount(len(timers))
+        self._table.setVerticalHeaderLabels(list(timers.keys()))
+        for row, summary in enumerate(timers.values()):
+            for column, key in enumerate(self.columns):
+                value = summary.get(key)
+                text = '' if value is None else str(value) if key == 'count' else f'{value:.1f}'
+                self._table.setItem(row, column, QTableWidgetItem(text))
+        counters = [f'{name}: {value}' for name, value in snapshot['counters'].items()]
+        gauges = [f'{name}: {gauge["value"]} (peak {gauge["peak"]})' for name, gauge in snapshot['gauges'].items()]
+        self._countersLabel.setText('\n'.join(counters + gauges))
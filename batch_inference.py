@@ -0,0 +1,267 @@
+import argparse
+from concurrent.futures import BrokenExecutor
+import csv
+import os
+import queue
+import sys
+import threading
+import time
+
+from models.inference import BackendModel, BaseBackendModel
+from models.graph import GraphBackendModel
+from models.sharded import ShardedBackendModel
+from models.cache import ResultCache
+from models.pipeline import IMG_EXTENSIONS, list_images
+from models.results import COLUMNS
+
+
+def collect_paths(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(list_images(item))
+        elif item.lower().endswith(IMG_EXTENSIONS):
+            paths.append(item)
+        else:
+            # plain text file list, one path per line
+            with open(item) as f:
+                paths.extend(line.strip() for line in f if line.strip())
+    # keep order, drop duplicates
+    return list(dict.fromkeys(paths))
+
+
+def result_to_row(path, result):
+    return [path,
+            BaseBackendModel.get_label('binary', result['pred']['binary']),
+            BaseBackendModel.get_label('subtype', result['pred']['subtype'])] + \
+        [float(p) for p in result['prob']['binary']] + \
+        [float(p) for p in result['prob']['subtype']]
+
+
+class CsvResultWriter():
+
+    def __init__(self, path, resume):
+        self.path = path
+        exists = resume and os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, 'a' if exists else 'w', newline='')
+        self._writer = csv.writer(self._file)
+        if not exists:
+            self._writer.writerow(COLUMNS)
+            self._file.flush()
+
+    @staticmethod
+    def done_paths(path):
+        if not os.path.exists(path):
+            return set()
+        with open(path, newline='') as f:
+            return {row['image_path'] for row in csv.DictReader(f)}
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultWriter():
+    # A parquet file cannot be appended to, so the output is a directory of
+    # part files. Every flushed part is complete on disk, which makes resume safe.
+
+    def __init__(self, path, resume, rows_per_part=4096):
+        import pyarrow
+        import pyarrow.parquet
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_part = rows_per_part
+        os.makedirs(path, exist_ok=True)
+        parts = self._parts(path)
+        if not resume:
+            for part in parts:
+                os.remove(part)
+            parts = []
+        self._partIndex = len(parts)
+        self._pending = []
+
+    @staticmethod
+    def _parts(path):
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.parquet'))
+
+    @staticmethod
+    def done_paths(path):
+        import pyarrow.parquet
+        done = set()
+        for part in ParquetResultWriter._parts(path):
+            done.update(pyarrow.parquet.read_table(part, columns=['image_path']).column('image_path').to_pylist())
+        return done
+
+    def write(self, rows):
+        self._pending.extend(rows)
+        if len(self._pending) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        columns = list(zip(*self._pending))
+        table = self._pa.table({name: list(column) for name, column in zip(COLUMNS, columns)})
+        part = os.path.join(self.path, f'part-{self._partIndex:05d}.parquet')
+        self._pq.write_table(table, part + '.tmp')
+        os.replace(part + '.tmp', part)
+        self._partIndex += 1
+        self._pending = []
+
+    def close(self):
+        self._flush()
+
+
+def make_writer(path, resume):
+    if path.endswith('.parquet'):
+        return ParquetResultWriter, ParquetResultWriter.done_paths(path) if resume else set()
+    return CsvResultWriter, CsvResultWriter.done_paths(path) if resume else set()
+
+
+def failed_row(path):
+    # same as the GUI export, labels marked failed and no probabilities
+    return [path, 'failed', 'failed'] + [0.0] * (len(COLUMNS) - 3)
+
+
+def run(backend, paths, writer, chunk_size=16, log=sys.stderr):
+    # inference runs in a producer thread so that writing the previous chunk
+    # overlaps with the forward passes of the next one, while the backend keeps
+    # decoding ahead across chunk boundaries
+    results = queue.Queue(maxsize=2)
+    error = []
+    failed = []
+
+    def produce():
+        remaining = iter(paths)
+        # pulled by the backend and not written yet
+        pending = {}
+
+        def pull():
+            for path in remaining:
+                pending[path] = None
+                yield path
+
+        try:
+            while True:
+                try:
+                    for result in backend.iter_inference(pull(), chunk_size):
+                        # only probabilities and predictions are written, drop the CAMs now
+                        results.put([result_to_row(path, result[path]) for path in result])
+                        for path in result:
+                            pending.pop(path, None)
+                    break
+                except BrokenExecutor:
+                    raise
+                except Exception as e:
+                    if len(pending) == 0:
+                        raise
+                    # the images in flight are run one by one, only the ones
+                    # that fail on their own are written as failed, then a new
+                    # stream takes the remaining paths
+                    print(f'chunk failed ({e}), retrying its {len(pending)} images one by one', file=log)
+                    for path in list(pending):
+                        try:
+                            row = result_to_row(path, backend.inference([path])[path])
+                        except BrokenExecutor:
+                            raise
+                        except Exception as e:
+                            print(f'{path} failed: {str(e) or type(e).__name__}', file=log)
+                            failed.append(path)
+                            row = failed_row(path)
+                        results.put([row])
+                        del pending[path]
+        except Exception as e:
+            error.append(e)
+        finally:
+            results.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    start = time.perf_counter()
+    producer.start()
+    done = 0
+    while True:
+        rows = results.get()
+        if rows is None:
+            break
+        with backend.metrics.timer('write'):
+            writer.write(rows)
+        done += len(rows)
+        elapsed = time.perf_counter() - start
+        print(f'{done}/{len(paths)} images, {done / elapsed:.2f} img/s', file=log)
+    producer.join()
+    if error:
+        raise error[0]
+    if failed:
+        print(f'{len(failed)} of {len(paths)} images could not be processed, written as failed rows', file=log)
+    return done, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the breast cancer classifier on a batch of images without the GUI.')
+    parser.add_argument('inputs', nargs='+', help='image files, directories or text files listing one image path per line')
+    parser.add_argument('-o', '--output', required=True, help='output .csv file or .parquet directory')
+    parser.add_argument('--resume', action='store_true', help='skip images already present in the output')
+    parser.add_argument('--chunk-size', type=int, default=16)
+    parser.add_argument('--reject-threshold', type=float, default=0.7)
+    parser.add_argument('--batch-size', type=int, default=None, help='defaults to the value found by python -m models.autotune, else 4')
+    parser.add_argument('--num-workers', type=int, default=None, help='decode threads, defaults to the tuned value, else 4')
+    parser.add_argument('--prefetch', type=int, default=4, help='number of batches decoded ahead of the model')
+    parser.add_argument('--cache', default=None, help='directory of the on-disk result cache, disabled if not given')
+    parser.add_argument('--cache-size', type=float, default=1.0, help='result cache size limit in GiB')
+    parser.add_argument('--backend', choices=['eager', 'graph', 'onnx'], default='eager',
+                        help='eager models, exported TorchScript graphs or exported ONNX graphs')
+    parser.add_argument('--precision', choices=['fp32', 'bf16'], default='fp32', help='eager backend only')
+    parser.add_argument('--channels-last', action='store_true', help='eager backend only')
+    parser.add_argument('--preprocess', choices=['fused', 'torchvision'], default='fused',
+                        help='uint8 resize-then-normalise pipeline, or the exact torchvision training transform')
+    parser.add_argument('--tile', action='store_true',
+                        help='classify images at least 1.5x the 700x460 model input from overlapping native resolution tiles, '
+                             'each image is still decoded whole (about 2 full RGB images in memory at a time)')
+    parser.add_argument('--processes', type=int, default=1, help='shard the images over this many worker processes')
+    parser.add_argument('--threads-per-process', type=int, default=None, help='intra-op threads of each process, defaults to cores / processes')
+    parser.add_argument('--metrics', default=None, help='record stage timings, counters and queue depths and write them to this JSON file')
+    args = parser.parse_args()
+
+    writerClass, done = make_writer(args.output, args.resume)
+    paths = [path for path in collect_paths(args.inputs) if path not in done]
+    print(f'{len(paths)} images to process, {len(done)} already done', file=sys.stderr)
+    if len(paths) == 0:
+        return
+
+    kwargs = dict(batch_size=args.batch_size, num_workers=args.num_workers, prefetch=args.prefetch, cam_mode='lazy',
+                  preprocess=args.preprocess, tile=args.tile)
+    if args.backend == 'eager':
+        backendClass = BackendModel
+        kwargs.update(precision=args.precision, channels_last=args.channels_last)
+    else:
+        backendClass = GraphBackendModel
+        kwargs['runtime'] = 'torchscript' if args.backend == 'graph' else 'onnxruntime'
+    if args.processes > 1:
+        if args.cache:
+            parser.error('--cache cannot be shared by several --processes')
+        backend = ShardedBackendModel(args.reject_threshold, args.processes, args.threads_per_process,
+                                      backend_class=backendClass, **kwargs)
+    else:
+        cache = ResultCache(args.cache, int(args.cache_size * (1 << 30))) if args.cache else None
+        backend = backendClass(args.reject_threshold, cache=cache, **kwargs)
+    # a model that cannot load fails here, instead of every image failing on its own
+    backend.warm_up()
+    writer = writerClass(args.output, args.resume)
+    backend.metrics.enable(args.metrics is not None)
+    try:
+        count, elapsed = run(backend, paths, writer, args.chunk_size)
+    finally:
+        writer.close()
+        if args.metrics:
+            backend.metrics.dump(args.metrics)
+    print(f'processed {count} images in {elapsed:.1f}s ({count / elapsed:.2f} img/s)', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
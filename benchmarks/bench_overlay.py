@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage
+from PyQt5.QtWidgets import QApplication
+from torchcam.utils import overlay_mask
+import UI
+
+
+def pil_to_qimage(img):
+    # what PIL's toqimage does for RGB images
+    data = img.tobytes('raw', 'RGB')
+    return QImage(data, img.width, img.height, img.width * 3, QImage.Format_RGB888).copy()
+
+
+def torchcam_path(imgPath, cam, width, height):
+    # the renderer before the NumPy overlay: overlay at source resolution, then scale
+    img = Image.open(imgPath).convert('RGB')
+    img = overlay_mask(img, Image.fromarray(cam), alpha=0.5)
+    return pil_to_qimage(img).scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+def numpy_path(imgPath, cam, width, height):
+    return UI.renderImage(imgPath, cam, width, height)
+
+
+def timeit(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the CAM overlay renderers.')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--viewer', type=int, nargs=2, default=[1000, 760], metavar=('WIDTH', 'HEIGHT'))
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    rng = np.random.default_rng(0)
+    cam = rng.random((15, 22), dtype=np.float32)
+    report = {'viewer': args.viewer, 'repeat': args.repeat, 'results': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for width, height, ext in [(700, 460, 'png'), (700, 460, 'jpg'), (2048, 1536, 'jpg')]:
+            imgPath = os.path.join(tmp, f'{width}x{height}.{ext}')
+            Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).save(imgPath)
+            reference = torchcam_path(imgPath, cam, *args.viewer)
+            rendered = numpy_path(imgPath, cam, *args.viewer)
+            entry = {
+                'image': f'{width}x{height}.{ext}',
+                'torchcam_ms': timeit(lambda: torchcam_path(imgPath, cam, *args.viewer), args.repeat) * 1000,
+                'numpy_ms': timeit(lambda: numpy_path(imgPath, cam, *args.viewer), args.repeat) * 1000,
+                'same_size': reference.size() == rendered.size(),
+            }
+            entry['speedup'] = entry['torchcam_ms'] / entry['numpy_ms']
+            report['results'].append(entry)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
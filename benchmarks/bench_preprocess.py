@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from PIL import Image
+from benchmarks.synthetic import synthetic_images
+from models.preprocess import Preprocessor, torchvision_transform
+
+
+def time_per_image(fn, paths, repeat):
+    fn(paths[0])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            fn(path)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parity and speed of the fused uint8 preprocessing against the torchvision training transform.')
+    parser.add_argument('--sizes', nargs='+', default=['700x460', '1400x920', '2800x1840'], help='source image sizes, WIDTHxHEIGHT')
+    parser.add_argument('--num-images', type=int, default=4, help='images per size and format')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-diff', type=float, default=None,
+                        help='exit with an error if the mean absolute difference in normalised units exceeds this')
+    parser.add_argument('--output', default=None, help='write the JSON report to this file as well')
+    args = parser.parse_args()
+
+    reference = torchvision_transform()
+    fused = Preprocessor()
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': platform.node(), 'cpus': os.cpu_count(),
+              'torch': torch.__version__, 'config': vars(args), 'results': []}
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            width, height = (int(side) for side in size.split('x'))
+            for fmt in ['png', 'jpg']:
+                root = os.path.join(tmp, f'{size}-{fmt}')
+                os.makedirs(root)
+                paths = synthetic_images(root, args.num_images, formats=(fmt,), size=(width, height))
+
+                def torchvision_path(path):
+                    with Image.open(path) as img:
+                        return reference(img.convert('RGB'))
+
+                def fused_path(path):
+                    return fused(fused.decode(path))
+
+                diffs = torch.stack([(torchvision_path(path) - fused_path(path)).abs() for path in paths])
+                torchvision_ms = time_per_image(torchvision_path, paths, args.repeat)
+                fused_ms = time_per_image(fused_path, paths, args.repeat)
+                result = {'size': size, 'format': fmt, 'torchvision_ms': torchvision_ms, 'fused_ms': fused_ms,
+                          'speedup': torchvision_ms / fused_ms,
+                          'mean_abs_diff': diffs.mean().item(), 'max_abs_diff': diffs.max().item()}
+                report['results'].append(result)
+                if args.max_diff is not None and result['mean_abs_diff'] > args.max_diff:
+                    failed = True
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if failed:
+        sys.exit(f'mean absolute difference above {args.max_diff}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import synthetic_images
+from models.compare import timed_inference
+from models.sharded import ShardedBackendModel
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Images/sec of ShardedBackendModel versus process count and threads per process.')
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--chunk-size', type=int, default=8)
+    parser.add_argument('--no-pin', action='store_true', help='do not bind processes to disjoint cores')
+    args = parser.parse_args()
+
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    report = {'cpus': cpus, 'images': args.images, 'pinned': not args.no_pin, 'results': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        img_path = synthetic_images(tmp, args.images)
+        for processes in args.processes:
+            for threads in args.threads:
+                if processes * threads > cpus:
+                    continue
+                backend = ShardedBackendModel(num_processes=processes, threads_per_process=threads, pin=not args.no_pin, cam_mode='lazy')
+                try:
+                    backend.warm_up()
+                    _, elapsed = timed_inference(backend, img_path, args.chunk_size)
+                finally:
+                    backend.close()
+                report['results'].append({'processes': processes, 'threads_per_process': threads, 'img_per_s': args.images / elapsed})
+                print(json.dumps(report['results'][-1]), file=sys.stderr)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from benchmarks.synthetic import synthetic_images
+
+
+def measure(fn, repeat, per=1):
+    # milliseconds per call divided by `per` items, after one untimed warm-up call
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000 / per)
+    return {'mean_ms': statistics.mean(times), 'median_ms': statistics.median(times), 'min_ms': min(times)}
+
+
+def bench_pipeline(img_path, batch_size, repeat):
+    import torch
+    from PIL import Image
+    from models.inference import BackendModel
+    from models.compare import timed_inference
+
+    backend = BackendModel(batch_size=batch_size, cam_mode='lazy')
+    backend.warm_up()
+    report = {}
+
+    def decode(paths):
+        for path in paths:
+            with Image.open(path) as img:
+                img.load()
+
+    for ext in sorted({os.path.splitext(path)[1] for path in img_path}):
+        paths = [path for path in img_path if path.endswith(ext)]
+        report['decode' + ext.replace('.', '_')] = measure(lambda: decode(paths), repeat, len(paths))
+
+    images = [Image.open(path).convert('RGB') for path in img_path]
+    report['transform'] = measure(lambda: [backend.data_transform(img) for img in images], repeat, len(images))
+
+    batch = torch.stack([backend.data_transform(img) for img in images[:batch_size]])
+    batch = backend._to_device(batch)
+    with torch.no_grad():
+        for task_type, name in [('binary', 'resnet50_forward'), ('subtype', 'densenet201_forward')]:
+            def forward():
+                with backend._forward_lock, backend._autocast():
+                    backend._forward(task_type, batch, False)
+            report[name] = measure(forward, repeat, len(batch))
+            report[name]['batch_size'] = len(batch)
+
+        # CAM extraction alone, on top of a forward pass made with the hooks registered
+        backend._load()
+        with backend._forward_lock, backend._cam_hooks():
+            for task_type in ['binary', 'subtype']:
+                output = backend._forward(task_type, batch[:1], False)[0]
+                extractor = backend._cam_extractors[task_type]
+                report['cam_' + task_type] = measure(lambda: extractor(torch.argmax(output, dim=1).tolist(), output), repeat)
+
+    size = 1000
+    binary_outputs = torch.softmax(torch.randn(size, 2), dim=1)
+    subtype_outputs = torch.softmax(torch.randn(size, 8), dim=1)
+    paths = [f'{i}.png' for i in range(size)]
+    report['postprocess'] = measure(lambda: backend._postprocess(paths, binary_outputs, subtype_outputs), repeat, size)
+
+    _, elapsed = timed_inference(backend, img_path, chunk_size=max(16, batch_size))
+    report['end_to_end'] = {'img_per_s': len(img_path) / elapsed}
+    return report
+
+
+def bench_gui(img_path, rows, repeat):
+    import numpy as np
+    from PyQt5.QtWidgets import QApplication
+    import UI
+    from models.inference import RandomBackendModel
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    report = {}
+    # row paths only, thumbnails load lazily and are not part of these timings
+    paths = [f'{img_path[i % len(img_path)]}?{i}' for i in range(rows)]
+    results = RandomBackendModel(delay=0).inference(paths)
+
+    table = UI.ImageTableWidget(None)
+    table.resize(400, 600)
+
+    def addOneByOne():
+        table.clearImages()
+        for path in paths:
+            table.addImage(path)
+
+    def addBulk():
+        table.clearImages()
+        table.addImages(paths)
+
+    report['table_addImage'] = measure(addOneByOne, repeat, rows)
+    report['table_addImages'] = measure(addBulk, repeat, rows)
+    report['table_updateResult'] = measure(lambda: table.updateResult(results), repeat, rows)
+    table.clearImages()
+
+    viewer = UI.ImageViewer(None)
+    viewer.resize(1000, 760)
+    cam = np.random.default_rng(0).random((15, 22), dtype=np.float32)
+
+    def setImageCold(cam, camMode):
+        viewer.clearCache()
+        viewer.setImage(img_path[0], cam, camMode)
+
+    report['viewer_setImage'] = measure(lambda: setImageCold(None, 0), repeat)
+    report['viewer_setImage_cam'] = measure(lambda: setImageCold(cam, 1), repeat)
+    report['viewer_setImage_cached'] = measure(lambda: viewer.setImage(img_path[0], cam, 1), repeat)
+    app.processEvents()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every inference stage and the main GUI paths on synthetic BreakHis-sized images.')
+    parser.add_argument('--num-images', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=2000, help='table rows for the GUI timings')
+    parser.add_argument('--skip-models', action='store_true', help='only time the GUI paths')
+    parser.add_argument('--skip-gui', action='store_true', help='only time the inference stages')
+    parser.add_argument('--output', default=None, help='write the JSON report to this file as well')
+    args = parser.parse_args()
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'config': vars(args),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        img_path = synthetic_images(tmp, args.num_images, formats=('png', 'jpg'))
+        if not args.skip_models:
+            report['pipeline'] = bench_pipeline(img_path, args.batch_size, args.repeat)
+        if not args.skip_gui:
+            report['gui'] = bench_gui(img_path, args.rows, args.repeat)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
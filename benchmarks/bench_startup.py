@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(start):
+    # runs in a fresh interpreter, `start` is the wall clock time the parent launched it
+    sys.path.insert(0, ROOT)
+    from PyQt5.QtCore import QEvent, QObject
+    from PyQt5.QtWidgets import QApplication
+    import main
+
+    timings = {}
+
+    class PaintFilter(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and 'first_paint_s' not in timings:
+                timings['first_paint_s'] = time.time() - start
+            return False
+
+    def ready(backendModel):
+        timings['ready_s'] = time.time() - start
+        app.quit()
+
+    app = QApplication(sys.argv)
+    window = main.Window()
+    paintFilter = PaintFilter()
+    window.installEventFilter(paintFilter)
+    window.backendReady.connect(ready)
+    window.show()
+    app.exec_()
+    print(json.dumps(timings), flush=True)
+    # don't wait for the model warm-up still running in the background
+    os._exit(0)
+
+
+def measure():
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    start = time.time()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', repr(start)],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure GUI time-to-first-paint and time-to-ready (Start enabled).')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-first-paint', type=float, default=None, help='exit with an error if the median first paint is slower (seconds)')
+    parser.add_argument('--max-ready', type=float, default=None, help='exit with an error if the median time-to-ready is slower (seconds)')
+    parser.add_argument('--child', type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child)
+        return
+
+    runs = [measure() for _ in range(args.repeat)]
+    report = {'repeat': args.repeat, 'runs': runs}
+    for key in ['first_paint_s', 'ready_s']:
+        values = [run[key] for run in runs]
+        report[key] = {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+    failed = []
+    if args.max_first_paint is not None and report['first_paint_s']['median'] > args.max_first_paint:
+        failed.append(f"first paint {report['first_paint_s']['median']:.2f}s > {args.max_first_paint}s")
+    if args.max_ready is not None and report['ready_s']['median'] > args.max_ready:
+        failed.append(f"ready {report['ready_s']['median']:.2f}s > {args.max_ready}s")
+    if failed:
+        sys.exit('startup regression: ' + ', '.join(failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+import os
+import numpy as np
+from PIL import Image
+
+
+def synthetic_images(root, count, formats=('png',), size=(700, 460), seed=0):
+    # BreakHis-sized RGB images. Smooth colour fields plus fine noise compress
+    # and decode more like stained tissue than pure noise does.
+    rng = np.random.default_rng(seed)
+    width, height = size
+    paths = []
+    for i in range(count):
+        coarse = Image.fromarray(rng.integers(80, 256, (height // 20, width // 20, 3), dtype=np.uint8))
+        pixels = np.asarray(coarse.resize(size, Image.BICUBIC), dtype=np.int16)
+        pixels += rng.integers(-12, 13, pixels.shape, dtype=np.int16)
+        path = os.path.join(root, f'{i:05d}.{formats[i % len(formats)]}')
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path)
+        paths.append(path)
+    return paths
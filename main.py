@@ -1,34 +1,241 @@
+import argparse
+import os
 import sys
-import pandas as pd
+import threading
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
 import UI
-from models.inference import *
-
-
-class InferenceTask(QObject):
+# torch, torchvision and pandas are imported on first use so the window paints
+# right away, BackendTask imports the inference stack in the background
+from models.base import BaseBackendModel, LazyCAM
+from models.camstore import CamStore
+from models.results import ResultStore
+
+
+class InferenceScheduler(QObject):
+    # Feeds the backend's iter_inference stream from a queue the GUI can change
+    # during a run: imports are appended, the selected image and the visible
+    # rows jump the queue, and the run can be paused or cancelled. Paths are
+    # pulled one at a time as the backend queues its batches, so its prefetch
+    # runs across the whole run. The selected image does not wait behind the
+    # prefetched batches, it is run on its own as soon as the current chunk is
+    # done. The control methods are called from the GUI thread.
 
     finished = pyqtSignal()
-    progress = pyqtSignal(dict, int)
+    progress = pyqtSignal(dict, int, int)
+    # {path: error message} of the images that could not be classified
+    failed = pyqtSignal(dict)
 
-    def __init__(self, backEndModel, paths):
+    def __init__(self, backEndModel, paths, batchSize=4):
         QObject.__init__(self)
         self.backEndModel = backEndModel
-        self.paths = paths
+        self.batchSize = batchSize
+        # insertion ordered sets
+        self._queue = dict.fromkeys(paths)
+        self._pending = {}
+        # run on their own while also queued in the stream, whose result is dropped
+        self._early = set()
+        self._selected = None
+        self._visible = []
+        self._paused = False
+        self._cancelled = False
+        self._closed = False
+        self._done = 0
+        self._condition = threading.Condition()
+
+
+    def add(self, paths):
+        # False once the run is over, the paths are left for the next one
+        with self._condition:
+            if self._closed:
+                return False
+            self._queue.update(dict.fromkeys(paths))
+            return True
+
+
+    def prioritise(self, selected, visible):
+        with self._condition:
+            self._selected = selected
+            self._visible = visible
+
+
+    def pause(self, paused):
+        with self._condition:
+            self._paused = paused
+            self._condition.notify()
+
+
+    def cancel(self):
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify()
+
+
+    def _waitWhilePaused(self):
+        # False once cancelled
+        with self._condition:
+            while self._paused and not self._cancelled:
+                self._condition.wait()
+            return not self._cancelled
+
+
+    def _nextPath(self):
+        if self._selected in self._queue:
+            return self._selected
+        for imgPath in self._visible:
+            if imgPath in self._queue:
+                return imgPath
+        return next(iter(self._queue))
+
+
+    def _paths(self):
+        # the backend pulls from here whenever it queues a batch, a path counts
+        # as pending until its result comes back
+        while self._waitWhilePaused():
+            with self._condition:
+                # never waits for imports, the batches queued before still have to run
+                if self._cancelled or len(self._queue) == 0:
+                    return
+                imgPath = self._nextPath()
+                del self._queue[imgPath]
+                self._pending[imgPath] = None
+                self.backEndModel.metrics.gauge('scheduler_queue', len(self._queue))
+            yield imgPath
+
+
+    def _total(self):
+        with self._condition:
+            return self._done + len(self._pending) + len(self._queue)
+
+
+    def _report(self, results, stream=True):
+        if stream and self._early:
+            early = self._early.intersection(results)
+            self._early -= early
+            results = {imgPath: result for imgPath, result in results.items() if imgPath not in early}
+        for imgPath in results:
+            self._pending.pop(imgPath, None)
+        self._done += len(results)
+        self.progress.emit(results, self._done, self._total())
+
+
+    def _runAlone(self, imgPath):
+        # a pending image through inference() on its own, a failure is reported for it alone
+        try:
+            self._report(self.backEndModel.inference([imgPath]), stream=False)
+        except Exception as e:
+            del self._pending[imgPath]
+            self._done += 1
+            self.failed.emit({imgPath: str(e) or type(e).__name__})
+            self.progress.emit({}, self._done, self._total())
+
+
+    def _runSelected(self):
+        with self._condition:
+            imgPath = self._selected
+            if imgPath in self._queue:
+                del self._queue[imgPath]
+                self._pending[imgPath] = None
+            elif imgPath in self._pending and imgPath not in self._early:
+                # already in the prefetch queue, up to `prefetch` batches away
+                self._early.add(imgPath)
+            else:
+                return
+        self._runAlone(imgPath)
+
+
+    def _isolate(self):
+        # after a failed batch the pending images are run one by one, so only
+        # the ones that fail on their own are reported
+        self._early.clear()
+        for imgPath in list(self._pending):
+            if not self._waitWhilePaused():
+                return
+            self._runAlone(imgPath)
+
+
+    def run(self):
+        try:
+            while self._waitWhilePaused():
+                try:
+                    # one stream for the whole queue
+                    for results in self.backEndModel.iter_inference(self._paths(), self.batchSize):
+                        self._report(results)
+                        if not self._waitWhilePaused():
+                            break
+                        self._runSelected()
+                except Exception:
+                    self._isolate()
+                with self._condition:
+                    # a new stream after an error, or for images imported once the last one had taken its final path
+                    if self._cancelled or len(self._queue) == 0:
+                        self._closed = True
+                        break
+        finally:
+            with self._condition:
+                self._closed = True
+            self.finished.emit()
+
+
+class CamTask(QRunnable):
+
+    def __init__(self, lazyCam, path, finished):
+        QRunnable.__init__(self)
+        self.lazyCam = lazyCam
+        self.path = path
+        self.finished = finished
+
 
-    
     def run(self):
-        for i in range(0, len(self.paths), 16):
-            result = self.backEndModel.inference(self.paths[i:i+16])
-            self.progress.emit(result, i+16 if i+16 < len(self.paths) else len(self.paths))
-        self.finished.emit()
+        error = ''
+        try:
+            self.lazyCam.compute()
+        except Exception as e:
+            # e.g. the inference daemon is unreachable, the CAM is requested again next time
+            error = str(e) or type(e).__name__
+        finally:
+            self.finished.emit(self.path, error)
+
+
+class BackendTask(QRunnable):
+
+    def __init__(self, camStore, ready, server=None, tile=False):
+        QRunnable.__init__(self)
+        self.camStore = camStore
+        self.ready = ready
+        self.server = server
+        self.tile = tile
+
+
+    def run(self):
+        if self.server is not None:
+            # weights live in the shared inference daemon, nothing heavy to import here
+            from models.remote import RemoteBackendModel
+            backEndModel = RemoteBackendModel(self.server, cam_store=self.camStore)
+        else:
+            from models.inference import BackendModel
+            from models.cache import ResultCache
+            # a shallow prefetch, visible rows jump the queue behind at most two batches
+            backEndModel = BackendModel(prefetch=2, cache=ResultCache(), cam_mode='lazy', cam_store=self.camStore, tile=self.tile)
+        self.ready.emit(backEndModel)
+        try:
+            backEndModel.warm_up()
+        except Exception:
+            # e.g. missing checkpoints, the error is raised again on the first real inference
+            pass
 
 
 class Window(QWidget):
 
-    def __init__(self):
+    # path and error message, empty once the CAM is computed
+    camComputed = pyqtSignal(str, str)
+    backendReady = pyqtSignal(object)
+    # metrics snapshot of the backend, once a second while statistics are enabled
+    statsUpdated = pyqtSignal(dict)
+
+    def __init__(self, server=None, stats=False, tile=False):
         QWidget.__init__(self)
         self.setWindowTitle("Breast Cancer Classifier")
         self._imageViewer = UI.ImageViewer(self)
@@ -36,18 +243,34 @@ class Window(QWidget):
         self._startButton = UI.IconTextButton(self, 'assets/play-64.ico', 'Start')
         self._saveButton = UI.IconTextButton(self, 'assets/save-64.png', 'Save')
         self._clearButton = UI.IconTextButton(self, 'assets/clear-64.png', 'Clear')
+        self._openSessionButton = UI.IconTextButton(self, 'assets/import-64.png', 'Open Session')
+        self._saveSessionButton = UI.IconTextButton(self, 'assets/save-64.png', 'Save Session')
         self._progressBar = QProgressBar(self)
+        self._pauseButton = QToolButton(self)
+        self._cancelButton = QToolButton(self)
         self._classComboBox = QComboBox(self)
         self._typeComboBox = QComboBox(self)
         self._camComboBox = QComboBox(self)
         self._predGroupBox = UI.PredictionGroupBox(self)
         self._probGroupBox = UI.ProbabilityGroupBox(self)
         self._imageTableWidget = UI.ImageTableWidget(self)
-
-        self._results = {}
-        self._backendModel = BackendModel()
+        self._statsPanel = UI.StatsPanel(self) if stats else None
+        self._statsTimer = QTimer(self)
+
+        self._results = ResultStore()
+        self._camStore = CamStore()
+        self._backendModel = None
+        self._scheduler = None
+        self._camTasks = set()
+        self._camThreadPool = QThreadPool(self)
+        self._camThreadPool.setMaxThreadCount(1)
+        # CAM tasks need the models as well, so they queue behind the backend loading
+        self._camThreadPool.start(BackendTask(self._camStore, self.backendReady, server, tile))
         self._imgPaths = []
         self._selectedImgPath = None
+        # session file the results are still read from, see openSession
+        self._sessionPath = None
+        self._statsEnabled = stats
 
         self._classComboBox.addItems(BaseBackendModel.get_all_labels('binary'))
         self._classComboBox.addItem('')
@@ -57,6 +280,15 @@ class Window(QWidget):
         self._typeComboBox.setCurrentIndex(self._typeComboBox.count()-1)
         self._camComboBox.addItems(['Disable CAM', 'Binary CAM', 'Subtype CAM'])
         self._progressBar.setValue(0)
+        self._pauseButton.setIcon(self.style().standardIcon(QStyle.SP_MediaPause))
+        self._pauseButton.setToolTip('Pause')
+        self._pauseButton.setCheckable(True)
+        self._pauseButton.setEnabled(False)
+        self._cancelButton.setIcon(self.style().standardIcon(QStyle.SP_MediaStop))
+        self._cancelButton.setToolTip('Cancel')
+        self._cancelButton.setEnabled(False)
+        self._startButton.setText('loading')
+        self._startButton.setEnabled(False)
         
 
         self._initUI()
@@ -64,6 +296,31 @@ class Window(QWidget):
 
 
     def _connectSignals(self):
+
+        def currentCam(imgPath, compute=True):
+            # with compute=False only CAMs that already exist are returned, none is computed
+            if self._camComboBox.currentIndex() == 0 or imgPath not in self._results:
+                return None
+            cams = self._results.get(imgPath)['cam']
+            if cams is None:
+                # restored from a session file without this CAM
+                if self._backendModel is None or not compute:
+                    return None
+                cams = LazyCAM(self._backendModel, imgPath)
+                self._results.set_cam(imgPath, cams)
+            if isinstance(cams, LazyCAM) and not cams.ready():
+                if compute:
+                    # the view is refreshed once the CAM is computed
+                    computeCam(imgPath, cams)
+                return None
+            return cams['binary'] if self._camComboBox.currentIndex() == 1 else cams['subtype']
+
+        def prefetchNeighbours():
+            # neighbours without a CAM yet are prerendered plain, computing theirs
+            # would queue forward passes behind a running batch
+            camMode = self._camComboBox.currentIndex()
+            self._imageViewer.prefetch([(imgPath, currentCam(imgPath, compute=False), camMode)
+                                        for imgPath in self._imageTableWidget.neighbourPaths(self._selectedImgPath)])
         
         def changeCurrentImage():
             if self._selectedImgPath is None:
@@ -73,15 +330,13 @@ class Window(QWidget):
                 self._classComboBox.setCurrentIndex(self._classComboBox.count()-1)
                 self._typeComboBox.setCurrentIndex(self._typeComboBox.count()-1)
                 return
-            if self._selectedImgPath in self._results.keys():
-                self._imageViewer.setImage(self._selectedImgPath, 
-                                          self._results[self._selectedImgPath]['cam']['binary'] if self._camComboBox.currentIndex() == 1 
-                                          else self._results[self._selectedImgPath]['cam']['subtype'] if self._camComboBox.currentIndex() == 2 
-                                          else None)
-                classPredIdx = self._results[self._selectedImgPath]['pred']['binary']
-                typePredIdx = self._results[self._selectedImgPath]['pred']['subtype']
+            if self._selectedImgPath in self._results:
+                self._imageViewer.setImage(self._selectedImgPath, currentCam(self._selectedImgPath), self._camComboBox.currentIndex())
+                result = self._results.get(self._selectedImgPath)
+                classPredIdx = result['pred']['binary']
+                typePredIdx = result['pred']['subtype']
                 self._predGroupBox.updatePredictionIndex(classPredIdx, typePredIdx)
-                self._probGroupBox.updateProbability(self._results[self._selectedImgPath]['prob']['binary'], self._results[self._selectedImgPath]['prob']['subtype'])
+                self._probGroupBox.updateProbability(result['prob']['binary'], result['prob']['subtype'])
                 self._classComboBox.setCurrentIndex(classPredIdx if classPredIdx is not None else self._classComboBox.count()-1)
                 self._typeComboBox.setCurrentIndex(typePredIdx if typePredIdx is not None else self._typeComboBox.count()-1)
             else:
@@ -90,31 +345,40 @@ class Window(QWidget):
                 self._probGroupBox.reset()
                 self._classComboBox.setCurrentIndex(self._classComboBox.count()-1)
                 self._typeComboBox.setCurrentIndex(self._typeComboBox.count()-1)
+            prefetchNeighbours()
                 
+        def camComputed(imgPath, error):
+            self._camTasks.discard(imgPath)
+            if imgPath != self._selectedImgPath:
+                return
+            if error:
+                # the image stays shown without CAM, selecting it again retries
+                QMessageBox.warning(self, 'Warning', f'Could not compute the CAM of {imgPath}:\n{error}')
+                return
+            changeCurrentImage()
+
+        def computeCam(imgPath, lazyCam):
+            if imgPath in self._camTasks:
+                return
+            self._camTasks.add(imgPath)
+            self._camThreadPool.start(CamTask(lazyCam, imgPath, self.camComputed))
+            if self._backendModel is not None:
+                self._backendModel.metrics.gauge('cam_queue', len(self._camTasks))
+
         def selectImage(imgPath):
             self._selectedImgPath = imgPath
+            updatePriority()
             changeCurrentImage()
 
 
         def imported(imgPaths):
             imgPaths = list(set(imgPaths) - set(self._imgPaths))
-            if len(imgPaths) < 300:
-                self._imageTableWidget.addImages(imgPaths)
-                self._imgPaths.extend(imgPaths)
-                return
-            dialog = QProgressDialog('Importing images...', 'Cancel', 0, len(imgPaths), self, Qt.WindowTitleHint | Qt.WindowCloseButtonHint)
-            dialog.setWindowTitle('Importing Images')
-            dialog.setWindowModality(Qt.WindowModal)
-            dialog.setFixedSize(400, 100)
-            dialog.show()
-            for i, imgPath in enumerate(imgPaths):
-                self._imgPaths.append(imgPath)
-                self._imageTableWidget.addImage(imgPath)
-                dialog.setLabelText(f'Importing {imgPath}')
-                dialog.setValue(i+1)
-                if dialog.wasCanceled():
-                    break
-            dialog.close()
+            # rows are virtual and thumbnails load in the background, no progress dialog needed
+            self._imageTableWidget.addImages(imgPaths)
+            self._imgPaths.extend(imgPaths)
+            if self._scheduler is not None and self._scheduler.add(imgPaths):
+                self._progressBar.setMaximum(self._progressBar.maximum() + len(imgPaths))
+                updatePriority()
 
 
         def importDialog():
@@ -124,34 +388,66 @@ class Window(QWidget):
             imported(file_paths[0])
 
         def freezeWidgetWhenInfer(freeze):
+            # importing stays possible, new images join the running queue
             enabled = not freeze
             self._startButton.setText('Start' if enabled else 'inferencing')
-            self._importButton.setEnabled(enabled)
             self._startButton.setEnabled(enabled)
             self._saveButton.setEnabled(enabled)
             self._clearButton.setEnabled(enabled)
+            self._openSessionButton.setEnabled(enabled)
+            self._saveSessionButton.setEnabled(enabled)
             self._classComboBox.setEnabled(enabled)
             self._typeComboBox.setEnabled(enabled)
-            self._imageTableWidget.setAcceptDrops(enabled)
+            self._pauseButton.setEnabled(freeze)
+            self._cancelButton.setEnabled(freeze)
+            self._pauseButton.setChecked(False)
+
+        def updatePriority():
+            if self._scheduler is not None:
+                self._scheduler.prioritise(self._selectedImgPath, self._imageTableWidget.visiblePaths())
 
-        def inferenceProgress(results, progress):
+        def inferenceProgress(results, progress, total):
             self._results.update(results)
             self._imageTableWidget.updateResult(results)
+            self._progressBar.setMaximum(total)
             self._progressBar.setValue(progress)
-            changeCurrentImage()
+            if self._selectedImgPath in results:
+                changeCurrentImage()
         
+        def inferenceFailed(errors):
+            for imgPath, message in errors.items():
+                self._results.set_error(imgPath, message)
+            self._imageTableWidget.updateResult(self._results.results(errors))
+            if self._selectedImgPath in errors:
+                changeCurrentImage()
+
         def inferenceFinished():
+            self._scheduler = None
             freezeWidgetWhenInfer(False)
 
+        def pauseInference(paused):
+            self._pauseButton.setIcon(self.style().standardIcon(QStyle.SP_MediaPlay if paused else QStyle.SP_MediaPause))
+            if self._scheduler is not None:
+                self._scheduler.pause(paused)
+
+        def cancelInference():
+            if self._scheduler is not None:
+                self._scheduler.cancel()
+
         def startInference():
-            toInfer = list(set(self._imgPaths) - set(self._results.keys()))
+            # table order, the selected image and the visible rows go first
+            toInfer = [imgPath for imgPath in self._imgPaths if imgPath not in self._results or imgPath in self._results.errors]
             if len(toInfer) == 0:
                 return
             freezeWidgetWhenInfer(True)
             self._progressBar.setValue(0)
             self._progressBar.setMaximum(len(toInfer))
-            self.task = InferenceTask(self._backendModel, toInfer)
+            # the local backend's (tuned) batch size, the daemon batches requests itself
+            self.task = InferenceScheduler(self._backendModel, toInfer, getattr(self._backendModel, 'batch_size', 4))
+            self._scheduler = self.task
+            updatePriority()
             self.task.progress.connect(inferenceProgress)
+            self.task.failed.connect(inferenceFailed)
             self.workerThread = QThread()
             self.task.moveToThread(self.workerThread)
             self.workerThread.started.connect(self.task.run)
@@ -161,72 +457,149 @@ class Window(QWidget):
             self.workerThread.finished.connect(self.workerThread.deleteLater)
             self.workerThread.start()
 
+        def reviewProblems():
+            # every reject and conflict in one dialog, True to save anyway
+            problems = self._results.problems()
+            if len(problems) == 0:
+                return True
+            box = QMessageBox(QMessageBox.Warning, 'Warning',
+                              f'{len(problems)} of {len(self._results)} images failed, are rejected or have a class incompatible with their type.\n' +
+                              'Review them first, or save them as they are.', parent=self)
+            box.setDetailedText('\n'.join(f'{reason}: {imgPath}' for imgPath, reason in problems))
+            saveButton = box.addButton('Save anyway', QMessageBox.AcceptRole)
+            box.addButton('Review', QMessageBox.RejectRole)
+            box.exec_()
+            if box.clickedButton() is saveButton:
+                return True
+            self._imageTableWidget.selectImageByPath(problems[0][0])
+            return False
+
         def saveResults():
-            df = pd.DataFrame(columns=['image_path', 'tumor_class', 'tumor_type'])
-            for imgPath in self._results.keys():
-                isConflict = BackendModel.checkConflict(self._results[imgPath]['pred']['binary'], self._results[imgPath]['pred']['subtype'])
-                if isConflict or self._results[imgPath]['pred']['binary'] is None or self._results[imgPath]['pred']['subtype'] is None:
-                    # display warning dialog
-                    tumorClass = BaseBackendModel.get_label('binary', self._results[imgPath]['pred']['binary'])
-                    tumorType = BaseBackendModel.get_label('subtype', self._results[imgPath]['pred']['subtype'])
-                    QMessageBox.warning(self, 'Warning', 
-                                        f'Conflict detected in image: {imgPath}\n' + 
-                                        f'class {tumorClass} is incompatible with type {tumorType}\n' +
-                                        'Please reselect the class and type for this image.')
-                    self._imageTableWidget.selectImageByPath(imgPath)
-                    return
-                tumorClass = BaseBackendModel.get_label('binary', self._results[imgPath]['pred']['binary'])
-                tumorType = BaseBackendModel.get_label('subtype', self._results[imgPath]['pred']['subtype'])
-                # append is deprecated
-                df.loc[len(df)] = [imgPath, tumorClass, tumorType]
-            file_path = QFileDialog.getSaveFileName(self, 'Save Results', './', 'CSV (*.csv)')
+            if len(self._results) == 0 or not reviewProblems():
+                return
+            file_path = QFileDialog.getSaveFileName(self, 'Save Results', './', 'CSV (*.csv);;Parquet (*.parquet)')
             if file_path[0] == '':
                 return
-            df.to_csv(file_path[0], index=False)
+            path = file_path[0]
+            if file_path[1].startswith('Parquet') and not path.endswith('.parquet'):
+                path += '.parquet'
+            try:
+                self._results.export(path)
+            except ImportError:
+                QMessageBox.warning(self, 'Warning', 'Saving parquet files requires pyarrow.')
+            except (OSError, ValueError) as e:
+                QMessageBox.warning(self, 'Warning', f'Could not save results {path}:\n{e}')
+
+        def saveSession():
+            file_path = QFileDialog.getSaveFileName(self, 'Save Session', './', 'Session (*.bcsession)')
+            if file_path[0] == '':
+                return
+            path = file_path[0] if file_path[0].endswith('.bcsession') else file_path[0] + '.bcsession'
+            from models.session import detach_session, save_session
+            try:
+                if self._sessionPath is not None and os.path.exists(path) and os.path.samefile(path, self._sessionPath):
+                    # a mapped file cannot be replaced on Windows, elsewhere its old copy would stay on disk while mapped
+                    detach_session(self._results, self._camStore)
+                    self._sessionPath = None
+                save_session(path, self._imgPaths, self._results)
+            except (OSError, ValueError) as e:
+                QMessageBox.warning(self, 'Warning', f'Could not save session {path}:\n{e}')
+
+        def openSession():
+            file_path = QFileDialog.getOpenFileName(self, 'Open Session', './', 'Session (*.bcsession)')
+            if file_path[0] == '':
+                return
+            from models.session import load_session
+            try:
+                imgPaths, results = load_session(file_path[0])
+            except (OSError, ValueError) as e:
+                QMessageBox.warning(self, 'Warning', f'Could not open session {file_path[0]}:\n{e}')
+                return
+            clear()
+            # predictions are copy-on-write views of the file, CAMs are read from it when shown
+            self._results = results
+            self._sessionPath = file_path[0]
+            self._imageTableWidget.addImages(imgPaths)
+            self._imgPaths.extend(imgPaths)
+            self._imageTableWidget.updateResult(results.results(results.paths))
 
         def clear():
             self._imgPaths = []
-            self._results = {}
+            self._results.clear()
+            self._sessionPath = None
+            self._camStore.clear()
+            self._imageViewer.clearCache()
             self._selectedImgPath = None
-            self._imageTableWidget.reset()
+            self._imageTableWidget.clearImages()
             changeCurrentImage()
 
         def classSelected(index):
             if index == self._classComboBox.count()-1 or self._selectedImgPath is None:
                 return
-            if not self._selectedImgPath in self._results.keys():
-                self._results[self._selectedImgPath] = BaseBackendModel.generate_empty_result()
-            self._results[self._selectedImgPath]['pred']['binary'] = index
-            updResult = {self._selectedImgPath: self._results[self._selectedImgPath]}
-            self._imageTableWidget.updateResult(updResult)
+            self._results.set_pred(self._selectedImgPath, 'binary', index)
+            self._imageTableWidget.updateResult(self._results.results([self._selectedImgPath]))
             changeCurrentImage()
         
         def typeSelected(index):
             if index == self._typeComboBox.count()-1 or self._selectedImgPath is None:
                 return
-            if not self._selectedImgPath in self._results.keys():
-                self._results[self._selectedImgPath] = BaseBackendModel.generate_empty_result()
-            self._results[self._selectedImgPath]['pred']['subtype'] = index
-            updResult = {self._selectedImgPath: self._results[self._selectedImgPath]}
-            self._imageTableWidget.updateResult(updResult)
+            self._results.set_pred(self._selectedImgPath, 'subtype', index)
+            self._imageTableWidget.updateResult(self._results.results([self._selectedImgPath]))
             changeCurrentImage()
 
         def camSelected(index):
             changeCurrentImage()
 
+        def backendReady(backendModel):
+            self._backendModel = backendModel
+            self._startButton.setText('Start')
+            self._startButton.setEnabled(True)
+            if self._statsEnabled:
+                backendModel.metrics.enable()
+                backendModel.metrics.listeners.append(self.statsUpdated.emit)
+                self._statsTimer.start(1000)
+
+        self.camComputed.connect(camComputed)
+        self.backendReady.connect(backendReady)
+        self._statsTimer.timeout.connect(lambda: self._backendModel.metrics.publish())
+        if self._statsPanel is not None:
+            self.statsUpdated.connect(self._statsPanel.updateStats)
         self._imageTableWidget.itemSelectionChanged.connect(lambda: selectImage(self._imageTableWidget.getSelectedImagePath()))
         self._imageTableWidget.imported.connect(imported)
 
         self._importButton.clicked.connect(importDialog)
         self._startButton.clicked.connect(startInference)
+        self._pauseButton.toggled.connect(pauseInference)
+        self._cancelButton.clicked.connect(cancelInference)
+        self._imageTableWidget.verticalScrollBar().valueChanged.connect(lambda value: updatePriority())
         self._saveButton.clicked.connect(saveResults)
         self._clearButton.clicked.connect(clear)
+        self._saveSessionButton.clicked.connect(saveSession)
+        self._openSessionButton.clicked.connect(openSession)
 
         self._classComboBox.activated.connect(classSelected)
         self._typeComboBox.activated.connect(typeSelected)
         self._camComboBox.activated.connect(camSelected)
 
 
+    def showStats(self):
+        self._statsPanel.show()
+
+
+    def dumpStats(self, path):
+        if self._backendModel is not None:
+            self._backendModel.metrics.dump(path)
+
+
+    def waitForBackgroundTasks(self):
+        if self._scheduler is not None:
+            # the chunk in flight finishes first
+            self._scheduler.cancel()
+            self.workerThread.wait()
+        self._camThreadPool.clear()
+        self._camThreadPool.waitForDone()
+
+
     def _initUI(self):
         self.resize(1500,800)
         self.setFixedSize(self.size())
@@ -241,6 +614,8 @@ class Window(QWidget):
         controllPanel.layout().addWidget(self._camComboBox, 1, 1)
         controllPanel.layout().addWidget(self._classComboBox, 2, 1)
         controllPanel.layout().addWidget(self._typeComboBox, 3, 1)
+        controllPanel.layout().addWidget(self._openSessionButton, 4, 0, alignment=Qt.AlignHCenter)
+        controllPanel.layout().addWidget(self._saveSessionButton, 4, 1, alignment=Qt.AlignHCenter)
         
         leftPanel = QWidget(self)
         leftPanel.setLayout(QVBoxLayout())
@@ -248,7 +623,13 @@ class Window(QWidget):
         spImgList.setVerticalStretch(1)
         self._imageTableWidget.setSizePolicy(spImgList)
         leftPanel.layout().addWidget(self._imageTableWidget)
-        leftPanel.layout().addWidget(self._progressBar)
+        progressPanel = QWidget(self)
+        progressPanel.setLayout(QHBoxLayout())
+        progressPanel.layout().setContentsMargins(0, 0, 0, 0)
+        progressPanel.layout().addWidget(self._progressBar)
+        progressPanel.layout().addWidget(self._pauseButton)
+        progressPanel.layout().addWidget(self._cancelButton)
+        leftPanel.layout().addWidget(progressPanel)
         leftPanel.layout().addWidget(controllPanel)
 
 
@@ -277,12 +658,25 @@ class Window(QWidget):
 
 
 def main():
-    app = QApplication(sys.argv)
-    window = Window()
+    parser = argparse.ArgumentParser(description='Breast cancer classifier GUI.')
+    parser.add_argument('--server', default=None, help='URL of a running inference daemon (python -m models.server) to use instead of loading the models')
+    parser.add_argument('--tile', action='store_true', help='classify large scans from native resolution tiles, each scan is still decoded whole, see readme')
+    parser.add_argument('--stats', action='store_true', help='show a live panel of the inference stage timings and queue depths')
+    parser.add_argument('--stats-file', default=None, help='record the stage timings and write them to this JSON file on exit')
+    args, qtArgs = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qtArgs)
+    window = Window(args.server, args.stats or args.stats_file is not None, args.tile)
 
     window.show()
-
-    sys.exit(app.exec_())
+    if args.stats:
+        window.showStats()
+
+    exitCode = app.exec_()
+    # the window is gone by now, but a background import or warm-up must not outlive the interpreter
+    window.waitForBackgroundTasks()
+    if args.stats_file:
+        window.dumpStats(args.stats_file)
+    sys.exit(exitCode)
 
 if __name__ == '__main__':
     main()
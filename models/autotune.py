@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+
+TUNING_FILE = './cache/autotune.json'
+DEFAULTS = {'batch_size': 4, 'num_workers': 4}
+
+
+def memory_status():
+    # (available, total) bytes of system memory, (None, None) where /proc is missing
+    try:
+        with open('/proc/meminfo') as f:
+            info = {line.split(':')[0]: int(line.split()[1]) * 1024 for line in f}
+        return info['MemAvailable'], info['MemTotal']
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+class MemoryGuard():
+    # PrefetchLoader hook that halves the batch size while less than `low` of
+    # the system memory is available and grows it back towards the configured
+    # size once more than `high` is free again.
+
+    def __init__(self, batch_size, low=0.10, high=0.25):
+        self.batch_size = batch_size
+        self.low = low
+        self.high = high
+
+    def __call__(self, loader):
+        available, total = memory_status()
+        if available is None:
+            return
+        if available < self.low * total and loader.batch_size > 1:
+            loader.batch_size //= 2
+        elif available > self.high * total and loader.batch_size < self.batch_size:
+            loader.batch_size = min(self.batch_size, loader.batch_size * 2)
+
+
+class PeakMemory():
+    # Samples the resident set size in a background thread, torch allocations
+    # are invisible to tracemalloc. CUDA runs use the allocator statistics.
+
+    def __init__(self, device, interval=0.01):
+        self.device = device
+        self.interval = interval
+        self.peak = 0
+
+    def __enter__(self):
+        import torch
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self._baseline = torch.cuda.memory_allocated(self.device)
+            return self
+        self._baseline = _rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss() - self._baseline)
+
+    def __exit__(self, *exc):
+        import torch
+        if self.device.type == 'cuda':
+            self.peak = torch.cuda.max_memory_allocated(self.device) - self._baseline
+            return
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss() - self._baseline)
+
+
+def host_key(device):
+    import torch
+    name = torch.cuda.get_device_name(device) if device.type == 'cuda' else platform.processor() or platform.machine()
+    return f'{platform.node()}|{os.cpu_count()} cpus|{name}|torch {torch.__version__}'
+
+
+def load_tuning(device=None, path=TUNING_FILE):
+    # the stored configuration of this host, or the defaults
+    if device is None:
+        from models.inference import device
+    try:
+        with open(path) as f:
+            tuned = json.load(f).get(host_key(device))
+    except (OSError, ValueError):
+        tuned = None
+    if tuned is None:
+        return dict(DEFAULTS)
+    return {key: tuned[key] for key in DEFAULTS}
+
+
+def save_tuning(device, config, path=TUNING_FILE):
+    try:
+        with open(path) as f:
+            tunings = json.load(f)
+    except (OSError, ValueError):
+        tunings = {}
+    tunings[host_key(device)] = config
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(tunings, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def tune(img_path, batch_sizes=(1, 2, 4, 8, 16), worker_counts=(1, 2, 4, 8), memory_budget=None, **backend_kwargs):
+    # Probes img/s and peak memory of every (batch size, decode workers) pair on
+    # one backend, so the models are loaded once. Batch sizes go in ascending
+    # order, the allocator rarely returns memory and a smaller batch measured
+    # after a larger one would look free. The fastest configuration whose
+    # peak stays under memory_budget (half the available memory by default) wins.
+    from models.inference import BackendModel
+    from models.compare import timed_inference
+    if memory_budget is None:
+        available, _ = memory_status()
+        memory_budget = available // 2 if available is not None else float('inf')
+    backend = BackendModel(cam_mode='lazy', **backend_kwargs)
+    backend.warm_up()
+    probes = []
+    for batch_size in sorted(batch_sizes):
+        for num_workers in sorted(worker_counts):
+            backend.configure_loader(batch_size, num_workers)
+            with PeakMemory(backend.device) as memory:
+                _, elapsed = timed_inference(backend, img_path, chunk_size=max(16, batch_size))
+            probes.append({'batch_size': batch_size, 'num_workers': num_workers,
+                           'img_per_s': len(img_path) / elapsed, 'peak_memory': memory.peak})
+    fitting = [probe for probe in probes if probe['peak_memory'] <= memory_budget] or probes[:1]
+    best = max(fitting, key=lambda probe: probe['img_per_s'])
+    return {key: best[key] for key in DEFAULTS}, probes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the fastest batch size and decode worker count for this machine and store them for the GUI and batch_inference.py.')
+    parser.add_argument('--images', default=None, help='folder of sample images, synthetic 700x460 images if not given')
+    parser.add_argument('--num-images', type=int, default=32)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--memory-budget', type=float, default=None, help='peak memory limit in GiB, half the available memory by default')
+    parser.add_argument('--dry-run', action='store_true', help='print the result without storing it')
+    args = parser.parse_args()
+
+    from models.inference import device
+    budget = int(args.memory_budget * (1 << 30)) if args.memory_budget else None
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.images:
+            from models.pipeline import list_images
+            img_path = list_images(args.images)[:args.num_images]
+        else:
+            import numpy as np
+            from PIL import Image
+            rng = np.random.default_rng(0)
+            img_path = []
+            for i in range(args.num_images):
+                img_path.append(os.path.join(tmp, f'{i:05d}.png'))
+                Image.fromarray(rng.integers(0, 256, (460, 700, 3), dtype=np.uint8)).save(img_path[-1])
+        start = time.perf_counter()
+        best, probes = tune(img_path, args.batch_sizes, args.workers, budget)
+    print(json.dumps({'host': host_key(device), 'best': best, 'probes': probes, 'seconds': time.perf_counter() - start}, indent=2))
+    if not args.dry_run:
+        save_tuning(device, best)
+
+
+if __name__ == '__main__':
+    main()
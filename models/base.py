@@ -0,0 +1,97 @@
+import itertools
+import threading
+from models.metrics import Metrics
+
+
+class BaseBackendModel():
+
+    def __init__(self, reject_threshold=0.7):
+        self.reject_threshold = reject_threshold
+        # stage timers, counters and queue depths, disabled until metrics.enable()
+        self.metrics = Metrics()
+
+    def inference(self, img_path):
+        raise NotImplementedError
+
+
+    def iter_inference(self, img_path, chunk_size=16):
+        # `img_path` may be any iterable, a chunk is pulled when it is run
+        img_path = iter(img_path)
+        while True:
+            chunk = list(itertools.islice(img_path, chunk_size))
+            if len(chunk) == 0:
+                return
+            yield self.inference(chunk)
+
+
+    @staticmethod
+    def get_label(task, id, abbrev=False):
+        assert task in ['binary', 'subtype'], 'task should be either binary or subtype'
+        labels = BaseBackendModel.get_all_labels(task, abbrev)
+        if id is None:
+            return 'reject'
+        if task == 'binary':
+            return labels[id] if id < 2 else 'reject'
+        else:
+            return labels[id] if id < 8 else 'reject'
+        
+    
+    @staticmethod
+    def get_all_labels(task, abbrev=False):
+        assert task in ['binary', 'subtype'], 'task should be either binary or subtype'
+        if abbrev:
+            bin_list = ['B', 'M']
+            subtype_list = ['A', 'F', 'PT', 'TA', 'DC', 'LC', 'MC', 'PC']
+        else:
+            bin_list = ['Benign', 'Malignant']
+            subtype_list = ['Adenosis', 'Fibroadenoma', 'Phyllodes Tumor', 'Tubular Adenoma', 'Ductal Carcinoma', 'Lobular Carcinoma', 'Mucinous Carcinoma', 'Papillary Carcinoma']
+
+        return bin_list if task == 'binary' else subtype_list
+    
+
+    @staticmethod
+    def generate_empty_result():
+        return {'pred':{'binary':None, 'subtype':None}, 'prob':{'binary':[0,0], 'subtype':[0,0,0,0,0,0,0,0]}, 'cam':{'binary':None, 'subtype':None}}
+    
+
+    @staticmethod
+    def checkConflict(tumorClass, tumorType):
+        assert tumorClass in [0, 1, None], 'tumorClass should be either 0 or 1'
+        assert tumorType in [0, 1, 2, 3, 4, 5, 6, 7, None], 'tumorType should be either 0, 1, 2, 3, 4, 5, 6, 7'
+        if tumorClass == None or tumorType == None:
+            return False
+        if tumorClass == 0 and tumorType not in [0, 1, 2, 3]:
+            return True
+        elif tumorClass == 1 and tumorType not in [4, 5, 6, 7]:
+            return True
+        else:
+            return False
+
+
+class LazyCAM():
+    # Stands in for a result's {'binary': cam, 'subtype': cam} dict when the
+    # backend runs with cam_mode='lazy'; both maps are computed on first access.
+
+    def __init__(self, backend, img_path):
+        self._backend = backend
+        self._img_path = img_path
+        self._cams = None
+        self._lock = threading.Lock()
+
+    def ready(self):
+        return self._cams is not None
+
+    def compute(self):
+        with self._lock:
+            if self._cams is None:
+                try:
+                    self._cams = self._backend.compute_cam(self._img_path)
+                    if self._backend.cam_store is not None:
+                        self._cams = self._backend.cam_store.handle(self._cams)
+                except OSError:
+                    # image moved or unreadable since inference, show it without CAM
+                    self._cams = {'binary': None, 'subtype': None}
+        return self._cams
+
+    def __getitem__(self, task):
+        return self.compute()[task]
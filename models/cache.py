@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import hashlib
+import io
+import os
+import threading
+import numpy as np
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache():
+    # On-disk inference results keyed by image content and model configuration,
+    # so renamed or moved files still hit and a new checkpoint misses.
+    # Entries are evicted least recently used first once max_bytes is exceeded;
+    # recency survives restarts through the entry file mtime.
+
+    def __init__(self, root='./cache/results', max_bytes=1 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        os.makedirs(root, exist_ok=True)
+        files = []
+        for name in os.listdir(root):
+            if not name.endswith('.npz'):
+                continue
+            stat = os.stat(os.path.join(root, name))
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+
+
+    def key(self, img_path, fingerprint):
+        return hashlib.sha256((fingerprint + file_digest(img_path)).encode()).hexdigest()
+
+
+    def _path(self, key):
+        return os.path.join(self.root, key + '.npz')
+
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with np.load(self._path(key)) as entry:
+                result = {'pred':{}, 'prob':{}, 'cam':{}}
+                for task in ['binary', 'subtype']:
+                    pred = int(entry[task + '_pred'])
+                    result['pred'][task] = pred if pred >= 0 else None
+                    result['prob'][task] = entry[task + '_prob'].tolist()
+                    result['cam'][task] = entry[task + '_cam'] if task + '_cam' in entry else None
+            os.utime(self._path(key))
+        except (OSError, ValueError, KeyError):
+            # removed or truncated behind our back, treat as a miss
+            with self._lock:
+                self._size -= self._entries.pop(key, 0)
+            return None
+        return result
+
+
+    def put(self, key, result):
+        arrays = {}
+        for task in ['binary', 'subtype']:
+            pred = result['pred'][task]
+            arrays[task + '_pred'] = np.int64(pred if pred is not None else -1)
+            arrays[task + '_prob'] = np.asarray(result['prob'][task], dtype=np.float32)
+            # CAMs computed on demand are not stored
+            if isinstance(result['cam'], dict) and result['cam'][task] is not None:
+                arrays[task + '_cam'] = np.asarray(result['cam'][task])
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        tmp = self._path(key) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp, self._path(key))
+        with self._lock:
+            self._size += buffer.tell() - self._entries.pop(key, 0)
+            self._entries[key] = buffer.tell()
+            self._evict()
+
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+    def clear(self):
+        with self._lock:
+            for key in self._entries:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._entries.clear()
+            self._size = 0
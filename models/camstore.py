@@ -0,0 +1,102 @@
+import tempfile
+import threading
+import numpy as np
+
+
+def quantise_uint8(cam):
+    # (uint8 map, low, scale) with cam ~= data * scale + low
+    cam = np.asarray(cam, dtype=np.float32)
+    low, high = float(cam.min()), float(cam.max())
+    scale = (high - low) / 255 if high > low else 1.0
+    return np.round((cam - low) / scale).astype(np.uint8), low, scale
+
+
+class CamStore():
+    # Compact storage for class activation maps. Maps stay at their native
+    # feature-map resolution (they are only upsampled when rendered), are
+    # quantised to uint8 or float16, and once `memory_budget` bytes are held in
+    # memory further maps are appended to a memory-mapped spill file.
+
+    def __init__(self, dtype='uint8', memory_budget=256 << 20, spill_dir=None, spill_chunk=64 << 20):
+        assert dtype in ['uint8', 'float16'], 'dtype should be either uint8 or float16'
+        self.dtype = np.dtype(dtype)
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.spill_chunk = spill_chunk
+        self._lock = threading.Lock()
+        self._spill_file = None
+        self.clear()
+
+
+    def clear(self):
+        with self._lock:
+            # entry: (in-memory array or spill offset, shape, offset, scale)
+            self._entries = []
+            self._memory = 0
+            self._spill = None
+            self._spill_used = 0
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+
+
+    def _quantise(self, cam):
+        if self.dtype == np.float16:
+            return np.asarray(cam, dtype=np.float16), 0.0, 1.0
+        return quantise_uint8(cam)
+
+
+    def put(self, cam):
+        data, low, scale = self._quantise(cam)
+        with self._lock:
+            if self._memory + data.nbytes <= self.memory_budget:
+                self._memory += data.nbytes
+                location = data
+            else:
+                location = self._spill_write(data)
+            self._entries.append((location, data.shape, low, scale))
+            return len(self._entries) - 1
+
+
+    def get(self, id):
+        with self._lock:
+            location, shape, low, scale = self._entries[id]
+            if not isinstance(location, np.ndarray):
+                nbytes = int(np.prod(shape)) * self.dtype.itemsize
+                location = np.frombuffer(self._spill[location:location+nbytes], dtype=self.dtype).reshape(shape)
+            cam = location.astype(np.float32)
+        if self.dtype == np.uint8:
+            cam *= scale
+            cam += low
+        return cam
+
+
+    def _spill_write(self, data):
+        data = data.reshape(-1).view(np.uint8)
+        if self._spill is None or self._spill_used + data.nbytes > len(self._spill):
+            size = max(self.spill_chunk, 2 * self._spill_used, self._spill_used + data.nbytes)
+            if self._spill_file is None:
+                self._spill_file = tempfile.TemporaryFile(dir=self.spill_dir, prefix='cams-')
+            self._spill_file.truncate(size)
+            self._spill = np.memmap(self._spill_file, dtype=np.uint8, mode='r+', shape=(size,))
+        offset = self._spill_used
+        self._spill[offset:offset+data.nbytes] = data
+        self._spill_used += data.nbytes
+        return offset
+
+
+    def handle(self, cams):
+        return CAMHandle(self, {task: None if cam is None else self.put(cam) for task, cam in cams.items()})
+
+
+class CAMHandle():
+    # Read-only stand-in for a result's {'binary': cam, 'subtype': cam} dict,
+    # maps are dequantised on access.
+
+    def __init__(self, store, ids):
+        self._store = store
+        self._ids = ids
+
+    def __getitem__(self, task):
+        id = self._ids[task]
+        return None if id is None else self._store.get(id)
@@ -0,0 +1,73 @@
+import argparse
+import json
+import time
+import numpy as np
+
+
+def timed_inference(backend, img_path, chunk_size=16):
+    # the first image is run separately so loading and warm-up are not timed
+    backend.inference(img_path[:1])
+    results = {}
+    start = time.perf_counter()
+    for chunk in backend.iter_inference(img_path, chunk_size):
+        results.update(chunk)
+    return results, time.perf_counter() - start
+
+
+def compare_backends(reference, candidate, img_path, chunk_size=16):
+    # Throughput and agreement of `candidate` against `reference` on the same
+    # images. Both backends should run without a result cache.
+    reference_results, reference_time = timed_inference(reference, img_path, chunk_size)
+    candidate_results, candidate_time = timed_inference(candidate, img_path, chunk_size)
+    report = {
+        'images': len(img_path),
+        'reference_img_per_s': len(img_path) / reference_time,
+        'candidate_img_per_s': len(img_path) / candidate_time,
+        'speedup': reference_time / candidate_time,
+    }
+    for task in ['binary', 'subtype']:
+        reference_prob = np.array([reference_results[path]['prob'][task] for path in img_path])
+        candidate_prob = np.array([candidate_results[path]['prob'][task] for path in img_path])
+        drift = np.abs(reference_prob - candidate_prob)
+        reference_accept = reference_prob.max(axis=1) >= reference.reject_threshold
+        candidate_accept = candidate_prob.max(axis=1) >= candidate.reject_threshold
+        report[task] = {
+            'argmax_agreement': float(np.mean(reference_prob.argmax(axis=1) == candidate_prob.argmax(axis=1))),
+            # agreement of the final predictions, rejects included
+            'pred_agreement': float(np.mean([reference_results[path]['pred'][task] == candidate_results[path]['pred'][task] for path in img_path])),
+            # share of images on the same side of the reject threshold
+            'reject_agreement': float(np.mean(reference_accept == candidate_accept)),
+            'max_prob_diff': float(drift.max()),
+            'mean_prob_diff': float(drift.mean()),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the probability drift of a reduced precision, channels-last or fused preprocessing BackendModel '
+                                                 'against fp32.')
+    parser.add_argument('images', help='folder of images to compare on')
+    parser.add_argument('--num-images', type=int, default=256)
+    parser.add_argument('--precision', choices=['fp32', 'bf16'], default='bf16')
+    parser.add_argument('--channels-last', action='store_true')
+    parser.add_argument('--preprocess', choices=['fused', 'torchvision'], default='fused')
+    parser.add_argument('--reference-preprocess', choices=['fused', 'torchvision'], default=None,
+                        help='preprocessing of the fp32 reference, defaults to --preprocess so only precision and memory format '
+                             'are compared, set it to compare the preprocessing paths')
+    parser.add_argument('--report', default=None, help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    from models.inference import BackendModel
+    from models.pipeline import list_images
+    img_path = list_images(args.images)[:args.num_images]
+    candidate = BackendModel(precision=args.precision, channels_last=args.channels_last, preprocess=args.preprocess)
+    reference = BackendModel(preprocess=args.reference_preprocess or args.preprocess)
+    report = compare_backends(reference, candidate, img_path)
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import inspect
+import torch
+import models.networks as networks
+from models.graph import GraphBackendModel
+from models.preprocess import INPUT_SIZE
+
+
+def export_torchscript(model, path):
+    example = torch.randn(1, 3, *INPUT_SIZE)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        # freezing inlines the weights as constants and folds batchnorm into the
+        # convolutions
+        frozen = torch.jit.freeze(traced)
+    torch.jit.save(frozen, path)
+
+
+def export_onnx(model, path):
+    example = torch.randn(1, 3, *INPUT_SIZE)
+    # newer torch defaults to the torch.export based exporter, which needs onnxscript
+    legacy = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(model, example, path, input_names=['image'], output_names=['prob', 'cam'],
+                          dynamic_axes={'image': {0: 'batch'}, 'prob': {0: 'batch'}, 'cam': {0: 'batch'}},
+                          opset_version=17, **legacy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the classifiers to graphs with a fixed {}x{} input for GraphBackendModel.'.format(*INPUT_SIZE))
+    parser.add_argument('--runtime', choices=['torchscript', 'onnxruntime', 'all'], default='torchscript',
+                        help='graph format to write, onnxruntime writes ONNX files')
+    args = parser.parse_args()
+
+    exporters = {'torchscript': export_torchscript, 'onnxruntime': export_onnx}
+    runtimes = list(exporters) if args.runtime == 'all' else [args.runtime]
+    for runtime in runtimes:
+        backend = GraphBackendModel(runtime=runtime)
+        for task_type, ckpt in backend._ckpts.items():
+            network, num_classes = backend._networks[task_type]
+            net = networks.load_checkpoint(networks.network_dict[network], num_classes, ckpt)
+            exporters[runtime](networks.CAMNet.from_network(net).eval(), backend._graphs[task_type])
+            print(f'{ckpt} -> {backend._graphs[task_type]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import contextlib
+import os
+import torch
+from models.inference import CKPT_DIR, BackendModel
+
+
+class GraphBackendModel(BackendModel):
+    # Runs the exported networks.CAMNet graphs written by models/export_graph.py,
+    # either as frozen TorchScript or through ONNX Runtime (optional dependency,
+    # the faster of the two on CPU). The graphs return (probs, cams) themselves,
+    # so neither the eager torchvision model definitions nor torchcam are imported.
+
+    def __init__(self, reject_threshold=0.7, runtime='torchscript', **kwargs):
+        super().__init__(reject_threshold, **kwargs)
+        assert runtime in ['torchscript', 'onnxruntime'], 'runtime should be either torchscript or onnxruntime'
+        assert self.precision == 'fp32' and self.memory_format == torch.contiguous_format, 'exported graphs run in fp32 NCHW'
+        self.runtime = runtime
+        if runtime == 'onnxruntime':
+            self.device = torch.device('cpu')
+        extension = '.pt' if runtime == 'torchscript' else '.onnx'
+        self._graphs = {
+            'binary': os.path.join(CKPT_DIR, 'resnet50-bin-graph' + extension),
+            'subtype': os.path.join(CKPT_DIR, 'densenet201-sub-graph' + extension),
+        }
+
+
+    def _weight_files(self):
+        return self._graphs
+
+
+    def _load_model(self, task_type):
+        if self.runtime == 'torchscript':
+            return torch.jit.load(self._graphs[task_type], map_location=self.device).eval()
+        import onnxruntime
+        return onnxruntime.InferenceSession(self._graphs[task_type], providers=['CPUExecutionProvider'])
+
+
+    def _forward(self, task_type, img_tensor, cam):
+        if self.runtime == 'torchscript':
+            probs, cams = self._model(task_type)(img_tensor)
+        else:
+            outputs = self._model(task_type).run(None, {'image': img_tensor.numpy()})
+            probs, cams = (torch.from_numpy(output) for output in outputs)
+        return probs, cams if cam else None
+
+
+    def _cam_hooks(self):
+        return contextlib.nullcontext()
@@ -1,185 +1,562 @@
+from collections import OrderedDict
+import contextlib
+import hashlib
+import itertools
+import json
+import os
+import threading
 from PIL import Image
 import torch
-from torch.utils.data import Dataset, DataLoader
-from torchvision import transforms
-import models.networks as networks
-from torchcam.methods import CAM
+from torch.utils.data import Dataset
+from models.pipeline import BatchBuffers, PrefetchLoader
+from models.autotune import MemoryGuard, load_tuning
+from models.cache import file_digest
+from models.base import BaseBackendModel, LazyCAM
+from models.metrics import Metrics
+from models.preprocess import INPUT_SIZE, Preprocessor, tile_boxes, torchvision_transform
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# next to this module, so the backends load from any working directory
+CKPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ckpt')
+
+def image_size(path):
+    # (width, height) from the header, the pixels are not decoded
+    with Image.open(path) as img:
+        return img.size
+
 
 class BreaKHis(Dataset):
 
-    def __init__(self, img_list, transform = None):
+    def __init__(self, img_list, transform = None, metrics = None, normalize = True):
         self.transform = transform
         self.img_list = img_list
+        self.metrics = metrics if metrics is not None else Metrics()
+        # with normalize=False a Preprocessor only resizes, the batch is normalised by the model thread
+        self.normalize = normalize
 
     def __getitem__(self, index):
         path = self.img_list[index]
 
-        img = Image.open(path)
-        if self.transform:
-            img = self.transform(img)
-        else:
-            img = transforms.ToTensor()(img)
+        with self.metrics.timer('decode'):
+            img = self._decode(path)
+        with self.metrics.timer('transform'):
+            if isinstance(self.transform, Preprocessor) and not self.normalize:
+                img = self.transform.resize(img)
+            elif self.transform:
+                img = self.transform(img)
+            else:
+                from torchvision import transforms
+                img = transforms.ToTensor()(img)
         return path, img
 
+    def _decode(self, path):
+        if isinstance(self.transform, Preprocessor):
+            return self.transform.decode(path)
+        img = Image.open(path)
+        img.load()
+        return img
+
     def __len__(self):
         return len(self.img_list)
 
 
-class BaseBackendModel():
-
-    def __init__(self, reject_threshold=0.7):
-        self.reject_threshold = reject_threshold
-
-    def inference(self, img_path):
-        raise NotImplementedError
-
-
-    @staticmethod
-    def get_label(task, id, abbrev=False):
-        assert task in ['binary', 'subtype'], 'task should be either binary or subtype'
-        labels = BaseBackendModel.get_all_labels(task, abbrev)
-        if id is None:
-            return 'reject'
-        if task == 'binary':
-            return labels[id] if id < 2 else 'reject'
-        else:
-            return labels[id] if id < 8 else 'reject'
-        
-    
-    @staticmethod
-    def get_all_labels(task, abbrev=False):
-        assert task in ['binary', 'subtype'], 'task should be either binary or subtype'
-        if abbrev:
-            bin_list = ['B', 'M']
-            subtype_list = ['A', 'F', 'PT', 'TA', 'DC', 'LC', 'MC', 'PC']
-        else:
-            bin_list = ['Benign', 'Malignant']
-            subtype_list = ['Adenosis', 'Fibroadenoma', 'Phyllodes Tumor', 'Tubular Adenoma', 'Ductal Carcinoma', 'Lobular Carcinoma', 'Mucinous Carcinoma', 'Papillary Carcinoma']
-
-        return bin_list if task == 'binary' else subtype_list
-    
+class TiledBreaKHis(BreaKHis):
+    # Tiles of large images at native resolution, as ((path, box), img) items
+    # ordered image by image. The tiles of an image share one decode, and only
+    # the `max_open` most recently used decoded images are kept around. PIL
+    # cannot decode a region of a PNG or JPEG, so each image is decoded whole:
+    # peak memory is about `max_open` full RGB images (3 bytes per pixel, e.g.
+    # 2 x 300 MB for 10k x 10k scans), not a few tiles. Images of more than
+    # twice PIL's Image.MAX_IMAGE_PIXELS are refused with a DecompressionBombError.
 
-    @staticmethod
-    def generate_empty_result():
-        return {'pred':{'binary':None, 'subtype':None}, 'prob':{'binary':[0,0], 'subtype':[0,0,0,0,0,0,0,0]}, 'cam':{'binary':None, 'subtype':None}}
-    
+    def __init__(self, img_sizes, tile_size, overlap, transform = None, metrics = None, normalize = True, max_open = 2):
+        tiles = [(path, box) for path, (width, height) in img_sizes.items() for box in tile_boxes(width, height, tile_size, overlap)]
+        super().__init__(tiles, transform, metrics, normalize)
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
 
-    @staticmethod
-    def checkConflict(tumorClass, tumorType):
-        assert tumorClass in [0, 1, None], 'tumorClass should be either 0 or 1'
-        assert tumorType in [0, 1, 2, 3, 4, 5, 6, 7, None], 'tumorType should be either 0, 1, 2, 3, 4, 5, 6, 7'
-        if tumorClass == None or tumorType == None:
-            return False
-        if tumorClass == 0 and tumorType not in [0, 1, 2, 3]:
-            return True
-        elif tumorClass == 1 and tumorType not in [4, 5, 6, 7]:
-            return True
-        else:
-            return False
+    def _decode(self, tile):
+        path, box = tile
+        with self._lock:
+            if path not in self._open:
+                self._open[path] = [threading.Lock(), None]
+                if len(self._open) > self.max_open:
+                    self._open.popitem(last=False)
+            self._open.move_to_end(path)
+            entry = self._open[path]
+        # the workers asking for tiles of the same image wait for a single decode
+        with entry[0]:
+            if entry[1] is None:
+                img = Image.open(path)
+                entry[1] = img.convert('RGB') if img.mode != 'RGB' else img
+                entry[1].load()
+        return entry[1].crop(box)
 
 
 class BackendModel(BaseBackendModel):
 
-    data_transform = transforms.Compose(
-            [
-                transforms.ToTensor(),
-                transforms.Normalize((0.7862, 0.6261, 0.7654), (0.1065, 0.1396, 0.0910)), # BreakHis normalization
-                transforms.Resize((460, 700), antialias=True)
-            ]
-        )
-
-    def __init__(self, reject_threshold=0.7):
+    def __init__(self, reject_threshold=0.7, batch_size=None, num_workers=None, prefetch=4, cache=None, cam_mode='eager', cam_store=None,
+                 precision='fp32', channels_last=False, preprocess='fused', tile=False, tile_threshold=1.5, tile_overlap=0.25):
         super().__init__(reject_threshold)
+        assert cam_mode in ['eager', 'lazy'], 'cam_mode should be either eager or lazy'
+        assert precision in ['fp32', 'bf16'], 'precision should be either fp32 or bf16'
+        assert preprocess in ['fused', 'torchvision'], 'preprocess should be either fused or torchvision'
+        # the fused uint8 path is much cheaper on large images, torchvision reproduces the training transform exactly
+        self.data_transform = Preprocessor() if preprocess == 'fused' else torchvision_transform()
+        # the fused path hands uint8 batches (a quarter of the float32 size) from the decode workers
+        # to the model thread, written into pooled buffers and normalised there a whole batch at a time
+        self._buffers = None
+        if preprocess == 'fused':
+            self._buffers = BatchBuffers((3,) + self.data_transform.size, pin=device.type == 'cuda')
 
-        self._models = {
-            'binary': networks.ResNet50(num_classes=2),
-            'subtype': networks.DenseNet201(num_classes=8),
+        self._models = {}
+        self._networks = {
+            'binary': ('ResNet50', 2),
+            'subtype': ('DenseNet201', 8),
         }
         self._ckpts = {
-            'binary': './models/ckpt/resnet50-bin.pth',
-            'subtype': './models/ckpt/densenet201-sub.pth',
+            'binary': os.path.join(CKPT_DIR, 'resnet50-bin.pth'),
+            'subtype': os.path.join(CKPT_DIR, 'densenet201-sub.pth'),
+        }
+        # (target layer, fc layer) of the softmax-wrapped models
+        self._cam_layers = {
+            'binary': ('0.resnet.layer4', '0.resnet.fc'),
+            'subtype': ('0.densenet.features', '0.densenet.classifier'),
         }
-        self.loaded = False
+        self.cam_mode = cam_mode
+        self.device = device
+        self._forward_lock = threading.Lock()
+        # None picks the values stored by `python -m models.autotune` for this host
+        tuned = load_tuning(device)
+        self._loader = None
+        self.configure_loader(batch_size or tuned['batch_size'], num_workers or tuned['num_workers'], prefetch)
+        self._cam_extractors = {}
+        self._ckpt_digests = None
+        self.cache = cache
+        self.cam_store = cam_store
+        self.precision = precision
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self._load_locks = {'binary': threading.Lock(), 'subtype': threading.Lock()}
+        # with `tile`, images at least tile_threshold times the model input on both sides are
+        # classified from native resolution tiles instead of being shrunk to the input size
+        self.tile = tile
+        self.tile_threshold = tile_threshold
+        self.tile_overlap = tile_overlap
 
     
-    def _load(self):
-        if self.loaded:
+    @property
+    def batch_size(self):
+        return self._loader.batch_size
+
+
+    def configure_loader(self, batch_size, num_workers, prefetch=None):
+        # only between runs, batches in flight use the old loader
+        old = self._loader
+        prefetch = prefetch if prefetch is not None else old.prefetch
+        # the guard shrinks batches while the machine runs short of memory
+        self._loader = PrefetchLoader(batch_size, num_workers, prefetch, adapt=MemoryGuard(batch_size), metrics=self.metrics)
+        if old is not None:
+            old.close()
+
+
+    def _load(self, task_type=None):
+        # each task's model is loaded independently on first use, concurrent
+        # callers of the same task wait for a single load
+        for task in ['binary', 'subtype'] if task_type is None else [task_type]:
+            if task in self._models:
+                continue
+            with self._load_locks[task]:
+                if task not in self._models:
+                    self._models[task] = self._load_model(task)
+
+
+    def _load_model(self, task_type):
+        # the eager model definitions and torchcam are only imported here, graph
+        # backends never need them
+        import models.networks as networks
+        network, num_classes = self._networks[task_type]
+        model = networks.load_checkpoint(networks.network_dict[network], num_classes, self._ckpts[task_type])
+        model = torch.nn.Sequential(model, torch.nn.Softmax(dim=1))
+        model.to(self.device, memory_format=self.memory_format)
+        model.eval()
+        if self.cam_mode == 'eager':
+            from torchcam.methods import CAM
+            # hooks are registered once, creating extractors per call would stack them up
+            self._cam_extractors[task_type] = CAM(model, *self._cam_layers[task_type])
+        return model
+
+
+    def _model(self, task_type):
+        if task_type not in self._models:
+            self._load(task_type)
+        return self._models[task_type]
+
+
+    def warm_up(self):
+        # loads both models and runs a dummy image through them, so the first
+        # real batch runs at steady-state speed
+        if self.cache is not None:
+            self._fingerprint()
+        img_tensor = self._to_device(torch.zeros((1, 3) + INPUT_SIZE))
+        with torch.no_grad():
+            for task_type in ['binary', 'subtype']:
+                self._load(task_type)
+                with self._forward_lock, self._autocast():
+                    self._forward(task_type, img_tensor, False)
+
+
+    def _weight_files(self):
+        return self._ckpts
+
+
+    def _forward(self, task_type, img_tensor, cam):
+        output = self._model(task_type)(img_tensor)
+        if not cam:
+            return output, None
+        with self.metrics.timer('cam_' + task_type):
+            return output, self._cam_extractors[task_type](torch.argmax(output, dim=1).tolist(), output)[0]
+
+
+    @contextlib.contextmanager
+    def _cam_hooks(self):
+        # in lazy mode the extractors are only registered while a CAM is computed
+        if self.cam_mode == 'eager':
+            yield
             return
-        self.loaded = True
-        for task_type in self._models.keys():
-            self._models[task_type].load_state_dict(torch.load(self._ckpts[task_type])['model_state_dict'])
-            self._models[task_type] = torch.nn.Sequential(self._models[task_type], torch.nn.Softmax(dim=1))
-            self._models[task_type].to(device)
-            self._models[task_type].eval()
+        from torchcam.methods import CAM
+        self._cam_extractors = {task_type: CAM(self._models[task_type], *self._cam_layers[task_type]) for task_type in self._models.keys()}
+        try:
+            yield
+        finally:
+            for extractor in self._cam_extractors.values():
+                extractor.remove_hooks()
+            self._cam_extractors = {}
+
+
+    def _autocast(self):
+        if self.precision == 'fp32':
+            return contextlib.nullcontext()
+        return torch.autocast(self.device.type, dtype=torch.bfloat16)
+
+
+    def _to_device(self, img):
+        return img.to(self.device, memory_format=self.memory_format)
+
+
+    def _fingerprint(self):
+        # everything besides the image content that changes the result
+        if self._ckpt_digests is None:
+            self._ckpt_digests = {task: file_digest(ckpt) for task, ckpt in self._weight_files().items()}
+        config = [self._ckpt_digests, self.reject_threshold, repr(self.data_transform)]
+        if self.precision != 'fp32':
+            # appended only when set so existing fp32 cache entries keep hitting
+            config.append(self.precision)
+        if self.tile:
+            config.append(['tile', self.tile_threshold, self.tile_overlap])
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+    def _lookup(self, img_path):
+        if self.cache is None:
+            return {}, {}, img_path
+        with self.metrics.timer('cache_lookup'):
+            fingerprint = self._fingerprint()
+            keys = dict(zip(img_path, self._loader.map(lambda path: self.cache.key(path, fingerprint), img_path)))
+            cached = {}
+            for path in img_path:
+                result = self.cache.get(keys[path])
+                if result is not None:
+                    if result['cam']['binary'] is None:
+                        result['cam'] = LazyCAM(self, path)
+                    cached[path] = result
+        self.metrics.count('cache_hits', len(cached))
+        return self._wrap_cams(cached), keys, [path for path in img_path if path not in cached]
+
+
+    def _store(self, results, keys):
+        if self.cache is not None:
+            for path, result in results.items():
+                self.cache.put(keys[path], result)
+        return self._wrap_cams(results)
+
+
+    def _wrap_cams(self, results):
+        # hand out compact store handles instead of raw float maps
+        if self.cam_store is not None:
+            for result in results.values():
+                if isinstance(result['cam'], dict):
+                    result['cam'] = self.cam_store.handle(result['cam'])
+        return results
 
 
     def inference(self, img_path):
-        self._load()
-        dataset = BreaKHis(img_path, transform=self.data_transform)
-        iterator = DataLoader(dataset, batch_size=4, shuffle=False, num_workers=4)
-        cam_extractors = {
-            'binary': CAM(self._models['binary']),
-            'subtype': CAM(self._models['subtype'])
-        }
+        cached, keys, img_path = self._lookup(img_path)
+        if len(img_path) == 0:
+            return cached
+        img_path, tiled = self._split_tiled(img_path)
+        if len(img_path) > 0:
+            cached.update(self._store(self._run(self._batches(img_path), len(img_path)), keys))
+        if len(tiled) > 0:
+            cached.update(self._store(self._run_tiled(tiled, self.cam_mode == 'eager'), keys))
+        return cached
+
+
+    @staticmethod
+    def _pieces(results, chunk_size):
+        # dicts of at most chunk_size results
+        results = list(results.items())
+        for i in range(0, len(results), chunk_size):
+            yield dict(results[i:i+chunk_size])
+
+
+    def iter_inference(self, img_path, chunk_size=16):
+        # yields dicts of at most chunk_size results, a model batch larger than
+        # chunk_size is handed out in several pieces. `img_path` may be any
+        # iterable, paths are only pulled when the loader queues their batch.
+        keys, cached, tiled = {}, {}, {}
+        dataset = BreaKHis([], transform=self.data_transform, metrics=self.metrics, normalize=self._buffers is None)
+        # a single batch stream over all paths keeps the prefetch queue full across chunk boundaries
+        batches = self._loader.batches(dataset, self._buffers, self._feed(img_path, dataset, keys, cached, tiled))
+        batches_per_chunk = max(1, chunk_size // self._loader.batch_size)
+        while True:
+            with self.metrics.timer('batch_wait'):
+                chunk = list(itertools.islice(batches, batches_per_chunk))
+            yield from self._pieces(cached, chunk_size)
+            cached.clear()
+            size = sum(len(path) for path, _ in chunk)
+            if size > 0:
+                yield from self._pieces(self._store(self._run(chunk, size), keys), chunk_size)
+            # a tiled image fills a batch with its own tiles, nothing is gained by waiting for more
+            for piece in self._pieces(tiled, chunk_size):
+                yield self._store(self._run_tiled(piece, self.cam_mode == 'eager'), keys)
+            tiled.clear()
+            if len(chunk) == 0:
+                break
+
+
+    def _feed(self, img_path, dataset, keys, cached, tiled):
+        # Index groups for the loader. Paths are pulled a batch at a time, cache
+        # hits and images to tile are set aside in `cached` and `tiled`, the rest
+        # is appended to the dataset. A group may be empty.
+        img_path = iter(img_path)
+        while True:
+            group = list(itertools.islice(img_path, self._loader.batch_size))
+            if len(group) == 0:
+                return
+            hits, group_keys, group = self._lookup(group)
+            keys.update(group_keys)
+            cached.update(hits)
+            group, group_tiled = self._split_tiled(group)
+            tiled.update(group_tiled)
+            start = len(dataset.img_list)
+            dataset.img_list.extend(group)
+            yield range(start, len(dataset.img_list))
+
+
+    def _batches(self, img_path):
+        dataset = BreaKHis(img_path, transform=self.data_transform, metrics=self.metrics, normalize=self._buffers is None)
+        return self._loader.batches(dataset, self._buffers)
+
+
+    def _split_tiled(self, img_path):
+        # (paths resized as a whole, {path: (width, height)} of the paths to tile), only headers are read
+        if not self.tile:
+            return img_path, {}
+        height, width = INPUT_SIZE
+        sizes = dict(zip(img_path, self._loader.map(image_size, img_path)))
+        tiled = {path: size for path, size in sizes.items()
+                 if min(size[0] / width, size[1] / height) >= self.tile_threshold}
+        return [path for path in img_path if path not in tiled], tiled
+
+
+    def _run_tiled(self, img_sizes, cam):
+        # Tiles of all images stream through the loader in full batches, tiles of
+        # different images share a batch. Per image only the running sum of the
+        # tile probabilities and the stitched CAMs at feature resolution are kept.
+        dataset = TiledBreaKHis(img_sizes, INPUT_SIZE, self.tile_overlap, transform=self.data_transform, metrics=self.metrics,
+                                normalize=self._buffers is None)
+        binary_sums = {path: torch.zeros(2) for path in img_sizes}
+        subtype_sums = {path: torch.zeros(8) for path in img_sizes}
+        tiles = {path: 0 for path in img_sizes}
+        canvases = {'binary': {}, 'subtype': {}}
+        if cam:
+            self._load()
+        metrics = self.metrics
+        batches = iter(self._loader.batches(dataset, self._buffers))
+        with torch.no_grad():
+            while True:
+                with metrics.timer('batch_wait'):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                keys, img = batch
+                with metrics.timer('normalize'):
+                    img_tensor = self._to_input(img)
+                with self._forward_lock, self._cam_hooks() if cam else contextlib.nullcontext(), self._autocast():
+                    with metrics.timer('forward_binary'):
+                        binary_output, binary_cam = self._forward('binary', img_tensor, cam)
+                    with metrics.timer('forward_subtype'):
+                        subtype_output, subtype_cam = self._forward('subtype', img_tensor, cam)
+                metrics.count('batches')
+                metrics.count('tiles', len(keys))
+                for j, (path, box) in enumerate(keys):
+                    binary_sums[path] += binary_output[j].float().cpu()
+                    subtype_sums[path] += subtype_output[j].float().cpu()
+                    tiles[path] += 1
+                    if cam:
+                        self._paste(canvases['binary'], path, img_sizes[path], box, binary_cam[j])
+                        self._paste(canvases['subtype'], path, img_sizes[path], box, subtype_cam[j])
+        img_path = list(img_sizes)
+        metrics.count('images', len(img_path))
+        binary_outputs = torch.stack([binary_sums[path] / tiles[path] for path in img_path])
+        subtype_outputs = torch.stack([subtype_sums[path] / tiles[path] for path in img_path])
+        binary_cams = subtype_cams = None
+        if cam:
+            binary_cams = [self._stitch(canvases['binary'][path]) for path in img_path]
+            subtype_cams = [self._stitch(canvases['subtype'][path]) for path in img_path]
+        with metrics.timer('postprocess'):
+            return self._postprocess(img_path, binary_outputs, subtype_outputs, binary_cams, subtype_cams)
+
+
+    @staticmethod
+    def _paste(canvases, path, img_size, box, cam):
+        # adds a tile's CAM into the image's (sum, weight) canvas at the tile's feature resolution
+        cam = cam.float().cpu()
+        tile_height, tile_width = INPUT_SIZE
+        scale_y, scale_x = cam.shape[0] / tile_height, cam.shape[1] / tile_width
+        if path not in canvases:
+            shape = (round(img_size[1] * scale_y), round(img_size[0] * scale_x))
+            canvases[path] = (torch.zeros(shape), torch.zeros(shape))
+        total, weight = canvases[path]
+        left, upper = round(box[0] * scale_x), round(box[1] * scale_y)
+        right, lower = min(total.shape[1], round(box[2] * scale_x)), min(total.shape[0], round(box[3] * scale_y))
+        resized = torch.nn.functional.interpolate(cam[None, None], size=(lower - upper, right - left), mode='bilinear', align_corners=False)[0, 0]
+        total[upper:lower, left:right] += resized
+        weight[upper:lower, left:right] += 1
+
+
+    @staticmethod
+    def _stitch(canvas):
+        total, weight = canvas
+        return total / weight.clamp(min=1)
+
+
+    def _to_input(self, img):
+        # device tensor in the model's memory format, uint8 batches are copied to the
+        # device before they are normalised and their buffer goes back to the pool
+        if img.dtype != torch.uint8:
+            return self._to_device(img)
+        img_tensor = self.data_transform.normalize(img.to(self.device), self.memory_format)
+        self._buffers.release(img)
+        return img_tensor
+
+
+    def _run(self, iterator, size):
+        # the number of images is known up front, so every batch is written into
+        # preallocated host buffers instead of growing tensors with torch.cat
         img_path = []
-        binary_outputs = torch.tensor([]).to(device)
-        subtype_outputs = torch.tensor([]).to(device)
-        binary_cams = torch.tensor([]).to(device)
-        subtype_cams = torch.tensor([]).to(device)
+        binary_outputs = torch.empty((size, 2))
+        subtype_outputs = torch.empty((size, 8))
+        binary_cams = None
+        subtype_cams = None
+        offset = 0
+        eager = self.cam_mode == 'eager'
+        metrics = self.metrics
+        batches = iter(iterator)
         with torch.no_grad():
-            for path, img in iterator:
-                img_tensor = img.to(device)
-                binary_output = self._models['binary'](img_tensor)
-                subtype_output = self._models['subtype'](img_tensor)
+            while True:
+                # time the model spends waiting on the decode workers
+                with metrics.timer('batch_wait'):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                path, img = batch
+                if len(path) == 0:
+                    continue
+                with metrics.timer('normalize'):
+                    img_tensor = self._to_input(img)
+                with self._forward_lock, self._autocast():
+                    # eager CAM extraction is included in the forward timings and reported on its own as well
+                    with metrics.timer('forward_binary'):
+                        binary_output, binary_cam = self._forward('binary', img_tensor, eager)
+                    with metrics.timer('forward_subtype'):
+                        subtype_output, subtype_cam = self._forward('subtype', img_tensor, eager)
+                metrics.count('batches')
+                metrics.count('images', len(path))
+                if eager and binary_cams is None:
+                    # CAM resolution depends on the network, it is only known after the first batch
+                    binary_cams = torch.empty((size,) + binary_cam.shape[1:])
+                    subtype_cams = torch.empty((size,) + subtype_cam.shape[1:])
 
+                end = offset + len(path)
+                binary_outputs[offset:end].copy_(binary_output)
+                subtype_outputs[offset:end].copy_(subtype_output)
+                if eager:
+                    binary_cams[offset:end].copy_(binary_cam)
+                    subtype_cams[offset:end].copy_(subtype_cam)
                 img_path += path
-                binary_outputs = torch.cat((binary_outputs, binary_output), dim=0)
-                subtype_outputs = torch.cat((subtype_outputs, subtype_output), dim=0)
-                
-                binary_cam = cam_extractors['binary'](torch.argmax(binary_output, dim=1).tolist(), binary_output)[0]
-                subtype_cam = cam_extractors['subtype'](torch.argmax(subtype_output, dim=1).tolist(), subtype_output)[0]
-                binary_cams = torch.cat((binary_cams, binary_cam), dim=0)
-                subtype_cams = torch.cat((subtype_cams, subtype_cam), dim=0)
-        
-        binary_outputs = binary_outputs.cpu()
-        subtype_outputs = subtype_outputs.cpu()
+                offset = end
+        with metrics.timer('postprocess'):
+            return self._postprocess(img_path, binary_outputs, subtype_outputs, binary_cams, subtype_cams)
+
+
+    def _postprocess(self, img_path, binary_outputs, subtype_outputs, binary_cams=None, subtype_cams=None):
+        # thresholding and conflict checks on the whole run, CAMs are only given in eager mode
         binary_maxes, binary_argmaxes = torch.max(binary_outputs, dim=1)
         subtype_maxes, subtype_argmaxes = torch.max(subtype_outputs, dim=1)
+        binary_preds = torch.where(binary_maxes < self.reject_threshold, -1, binary_argmaxes).tolist()
+        subtype_preds = torch.where(subtype_maxes < self.reject_threshold, -1, subtype_argmaxes).tolist()
+        binary_probs = binary_outputs.tolist()
+        subtype_probs = subtype_outputs.tolist()
 
         results = {}
-        for path, binary_output, subtype_output, binary_max, binary_argmax, subtype_max, subtype_argmax, binary_cam, subtype_cam\
-            in zip(img_path, binary_outputs, subtype_outputs, binary_maxes, binary_argmaxes, subtype_maxes, subtype_argmaxes, binary_cams, subtype_cams):
+        for i, path in enumerate(img_path):
             results[path] = {'pred':{}, 'prob':{}, 'cam':{}}
-            if binary_max < self.reject_threshold:
-                results[path]['pred']['binary'] = None
-            else:
-                results[path]['pred']['binary'] = binary_argmax.item()
-            if subtype_max < self.reject_threshold:
-                results[path]['pred']['subtype'] = None
-            else:
-                results[path]['pred']['subtype'] = subtype_argmax.item()
+            results[path]['pred']['binary'] = binary_preds[i] if binary_preds[i] >= 0 else None
+            results[path]['pred']['subtype'] = subtype_preds[i] if subtype_preds[i] >= 0 else None
             if BaseBackendModel.checkConflict(results[path]['pred']['binary'], results[path]['pred']['subtype']):
                 results[path]['pred']['binary'] = None
                 results[path]['pred']['subtype'] = None
-            results[path]['cam']['binary'] = binary_cam.cpu().numpy()
-            results[path]['prob']['binary'] = binary_output.tolist()
-            results[path]['cam']['subtype'] = subtype_cam.cpu().numpy()
-            results[path]['prob']['subtype'] = subtype_output.tolist()
+            results[path]['prob']['binary'] = binary_probs[i]
+            results[path]['prob']['subtype'] = subtype_probs[i]
+            if binary_cams is not None:
+                results[path]['cam']['binary'] = binary_cams[i].numpy()
+                results[path]['cam']['subtype'] = subtype_cams[i].numpy()
+            else:
+                results[path]['cam'] = LazyCAM(self, path)
         return results
 
 
+    def compute_cam(self, img_path):
+        if self.tile:
+            _, tiled = self._split_tiled([img_path])
+            if len(tiled) > 0:
+                cams = self._run_tiled(tiled, True)[img_path]['cam']
+                return {task: cams[task] for task in ['binary', 'subtype']}
+        self._load()
+        _, img = BreaKHis([img_path], transform=self.data_transform, metrics=self.metrics)[0]
+        img_tensor = self._to_device(img.unsqueeze(0))
+        cams = {}
+        # the lock keeps the temporary hooks from catching a concurrent inference batch
+        with self._forward_lock, self.metrics.timer('compute_cam'), torch.no_grad(), self._cam_hooks(), self._autocast():
+            for task_type in ['binary', 'subtype']:
+                cams[task_type] = self._forward(task_type, img_tensor, True)[1][0].float().cpu().numpy()
+        return cams
+
+
 # Used for testing
 class RandomBackendModel(BaseBackendModel):
 
-    def __init__(self, reject_threshold=0.7):
+    def __init__(self, reject_threshold=0.7, delay=10):
         super().__init__(reject_threshold)
+        # seconds per inference call, pretends to be the real models
+        self.delay = delay
 
     def inference(self, img_path):
         import numpy as np
         import time
-        time.sleep(10)
+        time.sleep(self.delay)
         result = {}
         for path in img_path:
             result[path] = {'pred':{}, 'prob':{}, 'cam':{}}
@@ -195,8 +572,9 @@ class RandomBackendModel(BaseBackendModel):
                 result[path]['pred']['subtype'] = np.argmax(result[path]['prob']['subtype'])
             result[path]['prob']['binary'] = result[path]['prob']['binary'].tolist()
             result[path]['prob']['subtype'] = result[path]['prob']['subtype'].tolist()
-            result[path]['cam']['binary'] = np.random.rand(460, 700)
-            result[path]['cam']['subtype'] = np.random.rand(460, 700)
+            # maps at the feature resolution of the real networks, they are upsampled when rendered
+            result[path]['cam']['binary'] = np.random.rand(15, 22).astype(np.float32)
+            result[path]['cam']['subtype'] = np.random.rand(14, 21).astype(np.float32)
 
         return result
     
\ No newline at end of file
@@ -0,0 +1,128 @@
+from bisect import bisect_left
+from collections import deque
+import contextlib
+import json
+import os
+import threading
+import time
+
+# upper bucket edges of the latency histograms in milliseconds, the last bucket is open
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class Histogram():
+    # Rolling window of the last `window` samples plus all-time count and total.
+    # Percentiles and bucket counts are computed over the window on snapshot.
+
+    def __init__(self, window=1024):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if len(samples) == 0:
+            return {'count': self.count, 'total_ms': self.total}
+        percentile = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+        buckets = [0] * (len(BUCKETS_MS) + 1)
+        for value in samples:
+            buckets[bisect_left(BUCKETS_MS, value)] += 1
+        return {'count': self.count, 'total_ms': self.total, 'mean_ms': sum(samples) / len(samples),
+                'p50_ms': percentile(0.5), 'p90_ms': percentile(0.9), 'p99_ms': percentile(0.99), 'max_ms': samples[-1],
+                'buckets': dict(zip([f'<={edge}' for edge in BUCKETS_MS] + [f'>{BUCKETS_MS[-1]}'], buckets))}
+
+
+class _Timer():
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metrics.observe(self._name, (time.perf_counter() - self._start) * 1000)
+
+
+class Metrics():
+    # Stage timers, counters and gauges (e.g. queue depths) of one backend.
+    # Disabled by default: `timer` hands back a shared no-op context and the
+    # other calls return straight away, so the hot paths pay one attribute check.
+    # `listeners` are called with every snapshot taken by `publish`.
+
+    def __init__(self, enabled=False, window=1024):
+        self.enabled = enabled
+        self.window = window
+        self.listeners = []
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._since = time.time()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def timer(self, name):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def observe(self, name, ms):
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(self.window)
+            self._histograms[name].add(ms)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        # last value and high-water mark
+        if not self.enabled:
+            return
+        with self._lock:
+            _, peak = self._gauges.get(name, (0, value))
+            self._gauges[name] = (value, max(peak, value))
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+            self._gauges = {}
+            self._since = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {name: histogram.summary() for name, histogram in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = {name: {'value': value, 'peak': peak} for name, (value, peak) in self._gauges.items()}
+        return {'since': self._since, 'time': time.time(), 'timers': histograms, 'counters': counters, 'gauges': gauges}
+
+    def publish(self):
+        snapshot = self.snapshot()
+        for listener in self.listeners:
+            listener(snapshot)
+        return snapshot
+
+    def dump(self, path):
+        snapshot = self.snapshot()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        return snapshot
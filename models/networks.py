@@ -1,4 +1,7 @@
+import inspect
+import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torchvision.models as models
 
 
@@ -107,6 +110,42 @@ class ResNeXt_101_32x8d(nn.Module):
         return x
     
 
+class CAMNet(nn.Module):
+    # Softmax classifier that also returns the class activation map of its top
+    # class, computed from the final conv features and the fc weights exactly
+    # like torchcam's CAM. Lets traced or quantized graphs produce CAMs without
+    # torchcam hooks.
+    def __init__(self, features, fc, feature_relu=False):
+        super(CAMNet, self).__init__()
+        self.features = features
+        self.fc = fc
+        self.feature_relu = feature_relu
+
+    def forward(self, x):
+        features = self.features(x)
+        if self.feature_relu:
+            features = F.relu(features)
+        pooled = F.adaptive_avg_pool2d(features, 1).flatten(1)
+        probs = F.softmax(self.fc(pooled), dim=1)
+        weights = self.fc.weight[torch.argmax(probs, dim=1)]
+        cams = torch.einsum('bc,bchw->bhw', weights, features)
+        cams = cams - cams.amin(dim=(1, 2), keepdim=True)
+        cams = cams / (cams.amax(dim=(1, 2), keepdim=True) + 1e-8)
+        return probs, cams
+
+    @staticmethod
+    def from_network(net):
+        if isinstance(net, (ResNet50, ResNet101)):
+            return CAMNet(nn.Sequential(*list(net.resnet.children())[:-2]), net.resnet.fc)
+        if isinstance(net, ResNeXt_101_32x8d):
+            return CAMNet(nn.Sequential(*list(net.resnext.children())[:-2]), net.resnext.fc)
+        if isinstance(net, (DenseNet121, DenseNet201)):
+            # densenet applies an in-place relu after `features`, so the maps torchcam
+            # hooks on that layer end up rectified as well
+            return CAMNet(net.densenet.features, net.densenet.classifier, feature_relu=True)
+        raise ValueError(f'{type(net).__name__} has no global pooling head to compute CAMs from')
+
+
 network_dict = {
     'ResNet50': ResNet50,
     'ResNet101': ResNet101,
@@ -116,3 +155,19 @@ network_dict = {
     'VGG19_bn': VGG19_bn,
     'ResNeXt_101_32x8d': ResNeXt_101_32x8d
 }
+
+
+def load_checkpoint(network, num_classes, ckpt):
+    # Builds `network` straight from the checkpoint tensors. The file is
+    # memory-mapped instead of read and copied up front, and the module is
+    # created on the meta device so no time is spent on random init that the
+    # checkpoint overwrites anyway. Older torch (< 2.1) falls back to a plain load.
+    if 'mmap' not in inspect.signature(torch.load).parameters:
+        net = network(num_classes=num_classes)
+        net.load_state_dict(torch.load(ckpt, map_location='cpu')['model_state_dict'])
+        return net
+    state_dict = torch.load(ckpt, map_location='cpu', mmap=True, weights_only=True)['model_state_dict']
+    with torch.device('meta'):
+        net = network(num_classes=num_classes)
+    net.load_state_dict(state_dict, assign=True)
+    return net
@@ -0,0 +1,137 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import weakref
+import torch
+
+
+IMG_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def list_images(root):
+    paths = []
+    for dirpath, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMG_EXTENSIONS):
+                paths.append(os.path.join(dirpath, name))
+    return paths
+
+
+class BatchBuffers():
+    # Pool of reusable batch tensors the decode workers write their images
+    # into, so batches are neither stacked nor reallocated. Pinned when they are
+    # copied to a GPU. A batch goes back to the pool with release() once the
+    # model has consumed it, batches that are never released are just collected.
+
+    def __init__(self, item_shape, dtype=torch.uint8, pin=False, capacity=8):
+        self.item_shape = tuple(item_shape)
+        self.dtype = dtype
+        self.pin = pin
+        self.capacity = capacity
+        self._free = []
+        # weak, a batch dropped without release() takes its buffer with it
+        self._leased = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+
+    def acquire(self, batch_size):
+        with self._lock:
+            for i, buffer in enumerate(self._free):
+                if len(buffer) >= batch_size:
+                    buffer = self._free.pop(i)
+                    break
+            else:
+                buffer = torch.empty((batch_size,) + self.item_shape, dtype=self.dtype, pin_memory=self.pin)
+            batch = buffer[:batch_size]
+            self._leased[batch.data_ptr()] = buffer
+        return batch
+
+
+    def release(self, batch):
+        with self._lock:
+            buffer = self._leased.pop(batch.data_ptr(), None)
+            if buffer is not None and len(self._free) < self.capacity:
+                self._free.append(buffer)
+
+
+class PrefetchLoader():
+    # Long-lived replacement for a per-call DataLoader. Decoding and transforms
+    # run on a persistent thread pool (PIL and torch release the GIL), and up to
+    # `prefetch` batches are queued ahead of the one the model is working on.
+
+    def __init__(self, batch_size=4, num_workers=4, prefetch=4, adapt=None, metrics=None):
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        # called with the loader before every batch is queued, may change batch_size
+        self.adapt = adapt
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='prefetch')
+
+
+    def batches(self, dataset, buffers=None, groups=None):
+        # with `buffers` every worker copies its image straight into its slot
+        # of a pooled batch tensor, otherwise the images are stacked here.
+        # `groups` are the dataset indices of each batch, by default batch_size
+        # consecutive ones. They are pulled one batch at a time, so a generator
+        # can decide what to load next while the batches before run; an empty
+        # group yields an empty batch ([], None).
+        groups = iter(groups if groups is not None else self._groups(len(dataset)))
+        pending = deque()
+
+        def load(index, batch, slot):
+            path, img = dataset[index]
+            batch[slot].copy_(img)
+            return path, None
+
+        def submit():
+            if self.adapt is not None:
+                self.adapt(self)
+            indices = next(groups, None)
+            if indices is None:
+                return
+            if buffers is None or len(indices) == 0:
+                pending.append((None, [self._executor.submit(dataset.__getitem__, i) for i in indices]))
+            else:
+                batch = buffers.acquire(len(indices))
+                pending.append((batch, [self._executor.submit(load, i, batch, slot) for slot, i in enumerate(indices)]))
+
+        for _ in range(max(1, self.prefetch)):
+            submit()
+        try:
+            while pending:
+                if self.metrics is not None and self.metrics.enabled:
+                    # batches fully decoded ahead of the model, 0 means the workers are the bottleneck
+                    self.metrics.gauge('prefetch_ready', sum(all(future.done() for future in futures) for _, futures in pending))
+                    self.metrics.gauge('batch_size', self.batch_size)
+                batch, futures = pending.popleft()
+                submit()
+                items = [future.result() for future in futures]
+                if len(items) == 0:
+                    yield [], None
+                    continue
+                yield [path for path, _ in items], batch if batch is not None else torch.stack([img for _, img in items])
+        finally:
+            # generator closed early, drop the batches nobody will consume
+            for _, futures in pending:
+                for future in futures:
+                    future.cancel()
+
+
+    def _groups(self, size):
+        # read batch_size for every group, the adapt hook may have changed it
+        start = 0
+        while start < size:
+            indices = range(start, min(start + self.batch_size, size))
+            start = indices.stop
+            yield indices
+
+
+    def map(self, fn, items):
+        return list(self._executor.map(fn, items))
+
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
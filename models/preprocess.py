@@ -0,0 +1,84 @@
+import numpy as np
+from PIL import Image
+import torch
+
+# BreakHis normalization
+MEAN = (0.7862, 0.6261, 0.7654)
+STD = (0.1065, 0.1396, 0.0910)
+INPUT_SIZE = (460, 700)
+
+
+def torchvision_transform(size=INPUT_SIZE, mean=MEAN, std=STD):
+    # the transform the networks were trained with, kept as the reference of Preprocessor
+    from torchvision import transforms
+    return transforms.Compose(
+            [
+                transforms.ToTensor(),
+                transforms.Normalize(mean, std),
+                transforms.Resize(size, antialias=True)
+            ]
+        )
+
+
+class Preprocessor():
+    # Same output as torchvision_transform() up to uint8 rounding, but resizes
+    # first and normalises afterwards: the image is scaled to `size` as uint8
+    # and only the target resolution is converted to float, with ToTensor's
+    # 1/255 and Normalize folded into a single multiply-add per pixel. JPEGs at
+    # least twice the target size are decoded at reduced scale (1/2, 1/4 or
+    # 1/8) by libjpeg itself.
+
+    def __init__(self, size=INPUT_SIZE, mean=MEAN, std=STD, draft=True):
+        self.size = tuple(size)
+        self.mean = tuple(mean)
+        self.std = tuple(std)
+        self.draft = draft
+        std = torch.tensor(std).view(3, 1, 1)
+        self._scale = 1 / (255 * std)
+        self._bias = -torch.tensor(mean).view(3, 1, 1) / std
+
+    def __repr__(self):
+        return f'Preprocessor(size={self.size}, mean={self.mean}, std={self.std}, draft={self.draft})'
+
+    def decode(self, path):
+        img = Image.open(path)
+        if self.draft and img.format == 'JPEG':
+            height, width = self.size
+            # never below the target size, so the resize below still only shrinks
+            img.draft('RGB', (width, height))
+        img.load()
+        return img
+
+    def resize(self, img):
+        # uint8 (3, H, W) view of the HWC pixels at the target resolution
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        height, width = self.size
+        if img.size != (width, height):
+            img = img.resize((width, height), Image.BILINEAR)
+        return torch.from_numpy(np.array(img)).permute(2, 0, 1)
+
+    def normalize(self, pixels, memory_format=torch.contiguous_format):
+        # uint8 image or batch -> normalised float32 on the same device, the
+        # dtype conversion and the layout change happen in the same pass
+        out = torch.empty(pixels.shape, device=pixels.device, memory_format=memory_format)
+        return torch.addcmul(self._bias.to(pixels.device), pixels, self._scale.to(pixels.device), out=out)
+
+    def __call__(self, img):
+        return self.normalize(self.resize(img))
+
+
+def tile_boxes(width, height, size=INPUT_SIZE, overlap=0.25):
+    # (left, upper, right, lower) boxes of `size` tiles covering the image,
+    # neighbours overlap by at least `overlap` of a tile and the last row and
+    # column are aligned with the image border
+    def starts(length, tile):
+        if length <= tile:
+            return [0]
+        stride = max(1, int(tile * (1 - overlap)))
+        count = -(-(length - tile) // stride) + 1
+        return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+    tile_height, tile_width = size
+    return [(left, upper, left + tile_width, upper + tile_height)
+            for upper in starts(height, tile_height) for left in starts(width, tile_width)]
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+import models.networks as networks
+from models.inference import CKPT_DIR, BackendModel, BreaKHis
+from models.graph import GraphBackendModel
+from models.pipeline import list_images
+from models.compare import compare_backends
+
+
+def quantization_engine():
+    engines = torch.backends.quantized.supported_engines
+    return 'x86' if 'x86' in engines else 'fbgemm' if 'fbgemm' in engines else 'qnnpack'
+
+
+def quantize(module, calib_batches):
+    # post-training static int8 quantization in FX graph mode
+    module = prepare_fx(module.eval(), get_default_qconfig_mapping(quantization_engine()), (calib_batches[0],))
+    with torch.no_grad():
+        for batch in calib_batches:
+            module(batch)
+    return convert_fx(module)
+
+
+class QuantizedBackendModel(GraphBackendModel):
+    # int8 CPU backend. The conv feature extractors are statically quantized,
+    # the fc head and CAM computation stay fp32 in networks.CAMNet, and the
+    # graphs are stored as TorchScript next to the fp32 checkpoints.
+
+    def __init__(self, reject_threshold=0.7, calib_dir=None, num_calib_images=64, **kwargs):
+        super().__init__(reject_threshold, **kwargs)
+        self.device = torch.device('cpu')
+        self.calib_dir = calib_dir
+        self.num_calib_images = num_calib_images
+        self._graphs = {
+            'binary': os.path.join(CKPT_DIR, 'resnet50-bin-int8.pt'),
+            'subtype': os.path.join(CKPT_DIR, 'densenet201-sub-int8.pt'),
+        }
+
+
+    def _load_model(self, task_type):
+        if not os.path.exists(self._graphs[task_type]):
+            if self.calib_dir is None:
+                raise FileNotFoundError('int8 checkpoints not found, run `python -m models.quantization --calib-dir <images>` first')
+            self.calibrate(self.calib_dir)
+        torch.backends.quantized.engine = quantization_engine()
+        return super()._load_model(task_type)
+
+
+    def calibrate(self, calib_dir):
+        torch.backends.quantized.engine = quantization_engine()
+        img_path = list_images(calib_dir)[:self.num_calib_images]
+        if len(img_path) == 0:
+            raise FileNotFoundError(f'no calibration images found in {calib_dir}')
+        calib_batches = [img for _, img in self._loader.batches(BreaKHis(img_path, transform=self.data_transform))]
+        for task_type, (network, num_classes) in self._networks.items():
+            net = networks.load_checkpoint(networks.network_dict[network], num_classes, self._ckpts[task_type])
+            model = networks.CAMNet.from_network(net).eval()
+            model.features = quantize(model.features, calib_batches)
+            with torch.no_grad():
+                traced = torch.jit.trace(model, calib_batches[0])
+            torch.jit.save(traced, self._graphs[task_type])
+        self._ckpt_digests = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate the int8 models and compare them against the fp32 checkpoints.')
+    parser.add_argument('--calib-dir', required=True, help='folder of images used for calibration')
+    parser.add_argument('--num-calib', type=int, default=64)
+    parser.add_argument('--eval-dir', default=None, help='folder of images for the comparison, defaults to the calibration folder')
+    parser.add_argument('--num-eval', type=int, default=256)
+    parser.add_argument('--report', default=None, help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    quantized = QuantizedBackendModel(num_calib_images=args.num_calib)
+    quantized.calibrate(args.calib_dir)
+    img_path = list_images(args.eval_dir or args.calib_dir)[:args.num_eval]
+    report = compare_backends(BackendModel(), quantized, img_path)
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import json
+import os
+import urllib.error
+import urllib.request
+import numpy as np
+from models.base import BaseBackendModel, LazyCAM
+
+
+class RemoteBackendModel(BaseBackendModel):
+    # Client of the inference daemon in models/server.py. Only the standard
+    # library and numpy are needed, torch is never imported in the client.
+    # CAMs are fetched from the daemon when first shown.
+
+    def __init__(self, url='http://127.0.0.1:8765', cam_store=None, timeout=600):
+        # the reject threshold is configured on the daemon, see warm_up
+        super().__init__(None)
+        self.url = url.rstrip('/')
+        self.cam_store = cam_store
+        self.timeout = timeout
+
+
+    def _request(self, endpoint, payload=None):
+        data = None if payload is None else json.dumps(payload).encode()
+        request = urllib.request.Request(self.url + endpoint, data=data, headers={'Content-Type': 'application/json'})
+        try:
+            # round trip including the daemon's batching delay, its stages are served at /metrics
+            with self.metrics.timer('request' + endpoint.replace('/', '_')), urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read())['error']
+            except (ValueError, KeyError):
+                message = str(e)
+            if e.code == 404:
+                raise FileNotFoundError(message) from None
+            raise RuntimeError(f'inference server error: {message}') from None
+
+
+    def warm_up(self):
+        info = self._request('/info')
+        self.reject_threshold = info['reject_threshold']
+        return info
+
+
+    def inference(self, img_path):
+        # the daemon may run in another working directory
+        paths = {os.path.abspath(path): path for path in img_path}
+        response = self._request('/inference', {'paths': list(paths)})
+        results = {}
+        for path, result in response.items():
+            results[paths[path]] = {'pred': result['pred'], 'prob': result['prob'], 'cam': LazyCAM(self, paths[path])}
+        self.metrics.count('images', len(results))
+        return results
+
+
+    def server_metrics(self):
+        return self._request('/metrics')
+
+
+    def compute_cam(self, img_path):
+        cams = self._request('/cam', {'path': os.path.abspath(img_path)})
+        return {task: np.asarray(cam, dtype=np.float32) for task, cam in cams.items()}
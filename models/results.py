@@ -0,0 +1,162 @@
+import numpy as np
+from models.base import BaseBackendModel
+
+COLUMNS = ['image_path', 'tumor_class', 'tumor_type'] + \
+    ['prob_' + label for label in BaseBackendModel.get_all_labels('binary', abbrev=True)] + \
+    ['prob_' + label for label in BaseBackendModel.get_all_labels('subtype', abbrev=True)]
+
+# (binary, subtype) pairs that checkConflict rejects, as a lookup table
+_CONFLICT = np.array([[BaseBackendModel.checkConflict(tumorClass, tumorType) for tumorType in range(8)] for tumorClass in range(2)])
+
+
+class ResultStore():
+    # Columnar results of one session: a path list with a path -> row id index,
+    # prediction ids (-1 for reject) and probability matrices that grow by
+    # doubling, so a batch of results is appended with a few array assignments.
+    # CAMs (handles or LazyCAMs) stay in a plain list next to them. `manual`
+    # flags the predictions set by hand, bit 1 binary and bit 2 subtype.
+    # `errors` holds the message of every image that could not be classified.
+
+    def __init__(self, capacity=1024):
+        self.paths = []
+        self._index = {}
+        self._cams = []
+        self.binary_pred = np.full(capacity, -1, dtype=np.int8)
+        self.subtype_pred = np.full(capacity, -1, dtype=np.int8)
+        self.binary_prob = np.zeros((capacity, 2), dtype=np.float32)
+        self.subtype_prob = np.zeros((capacity, 8), dtype=np.float32)
+        self.manual = np.zeros(capacity, dtype=np.uint8)
+        self.errors = {}
+
+    @classmethod
+    def from_arrays(cls, paths, binary_pred, subtype_pred, binary_prob, subtype_prob, manual, cams):
+        # adopts the arrays as they are, e.g. copy-on-write views of a session file
+        store = cls(0)
+        store.paths = list(paths)
+        store._index = {path: i for i, path in enumerate(store.paths)}
+        store._cams = list(cams)
+        store.binary_pred = binary_pred
+        store.subtype_pred = subtype_pred
+        store.binary_prob = binary_prob
+        store.subtype_prob = subtype_prob
+        store.manual = manual
+        return store
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self._index
+
+    def _grow(self, size):
+        capacity = len(self.binary_pred)
+        if size <= capacity:
+            return
+        capacity = max(capacity, 1024)
+        while capacity < size:
+            capacity *= 2
+        for name in ['binary_pred', 'subtype_pred', 'binary_prob', 'subtype_prob', 'manual']:
+            old = getattr(self, name)
+            new = np.full((capacity,) + old.shape[1:], -1 if old.dtype == np.int8 else 0, dtype=old.dtype)
+            new[:len(self.paths)] = old[:len(self.paths)]
+            setattr(self, name, new)
+
+    def _ids(self, paths):
+        new = [path for path in paths if path not in self._index]
+        if new:
+            self._grow(len(self.paths) + len(new))
+            for path in new:
+                self._index[path] = len(self.paths)
+                self.paths.append(path)
+                self._cams.append({'binary': None, 'subtype': None})
+        return np.fromiter((self._index[path] for path in paths), dtype=np.int64, count=len(paths))
+
+    def update(self, results):
+        # {path: result} as returned by a backend, existing rows are overwritten
+        if len(results) == 0:
+            return
+        ids = self._ids(list(results))
+        values = list(results.values())
+        self.binary_pred[ids] = [-1 if result['pred']['binary'] is None else result['pred']['binary'] for result in values]
+        self.subtype_pred[ids] = [-1 if result['pred']['subtype'] is None else result['pred']['subtype'] for result in values]
+        self.binary_prob[ids] = [result['prob']['binary'] for result in values]
+        self.subtype_prob[ids] = [result['prob']['subtype'] for result in values]
+        self.manual[ids] = 0
+        for i, result in zip(ids, values):
+            self._cams[i] = result['cam']
+        for path in results:
+            self.errors.pop(path, None)
+
+    def set_error(self, path, message):
+        # an empty row marked as failed, a later result replaces it
+        self.update({path: BaseBackendModel.generate_empty_result()})
+        self.errors[path] = message
+
+    def set_pred(self, path, task, index):
+        # manual label, a path without results gets an empty row first
+        if path not in self._index:
+            self.update({path: BaseBackendModel.generate_empty_result()})
+        pred = self.binary_pred if task == 'binary' else self.subtype_pred
+        pred[self._index[path]] = -1 if index is None else index
+        self.manual[self._index[path]] |= 1 if task == 'binary' else 2
+
+    def row(self, path):
+        # row id of a path, -1 if it has no result
+        return self._index.get(path, -1)
+
+    def set_cam(self, path, cams):
+        self._cams[self._index[path]] = cams
+
+    def cam(self, i):
+        return self._cams[i]
+
+    def get(self, path):
+        # the result in the backend's dict layout
+        i = self._index[path]
+        binary, subtype = int(self.binary_pred[i]), int(self.subtype_pred[i])
+        return {'pred': {'binary': binary if binary >= 0 else None, 'subtype': subtype if subtype >= 0 else None},
+                'prob': {'binary': self.binary_prob[i].tolist(), 'subtype': self.subtype_prob[i].tolist()},
+                'cam': self._cams[i], 'error': self.errors.get(path)}
+
+    def results(self, paths):
+        return {path: self.get(path) for path in paths}
+
+    def clear(self):
+        self.__init__()
+
+    def problems(self):
+        # [(path, reason)] of every failed, rejected or conflicting prediction, in insertion order
+        size = len(self.paths)
+        binary, subtype = self.binary_pred[:size], self.subtype_pred[:size]
+        rejected = (binary < 0) | (subtype < 0)
+        conflict = ~rejected & _CONFLICT[binary.clip(0), subtype.clip(0)]
+        reasons = np.where(conflict, 'conflict', 'reject')
+        return [(self.paths[i], 'failed' if self.paths[i] in self.errors else str(reasons[i]))
+                for i in np.flatnonzero(rejected | conflict)]
+
+    def columns(self):
+        size = len(self.paths)
+        # -1 indexes the trailing 'reject'
+        binary_labels = np.array(BaseBackendModel.get_all_labels('binary') + ['reject'], dtype=object)
+        subtype_labels = np.array(BaseBackendModel.get_all_labels('subtype') + ['reject'], dtype=object)
+        columns = {'image_path': np.array(self.paths, dtype=object),
+                   'tumor_class': binary_labels[self.binary_pred[:size]],
+                   'tumor_type': subtype_labels[self.subtype_pred[:size]]}
+        for j, name in enumerate(COLUMNS[3:5]):
+            columns[name] = self.binary_prob[:size, j]
+        for j, name in enumerate(COLUMNS[5:]):
+            columns[name] = self.subtype_prob[:size, j]
+        failed = [self._index[path] for path in self.errors]
+        columns['tumor_class'][failed] = 'failed'
+        columns['tumor_type'][failed] = 'failed'
+        return columns
+
+    def export(self, path):
+        # one vectorised write, parquet needs pyarrow
+        import pandas as pd
+        df = pd.DataFrame(self.columns(), columns=COLUMNS)
+        if path.endswith('.parquet'):
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+        return len(df)
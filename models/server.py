@@ -0,0 +1,160 @@
+import argparse
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+import threading
+import time
+from models.inference import BackendModel
+from models.cache import ResultCache
+
+
+class DynamicBatcher():
+    # Coalesces concurrent inference requests into a single backend call. A
+    # batch is dispatched once `max_batch` images are waiting or the oldest
+    # request has waited `max_latency` seconds, whichever comes first.
+
+    def __init__(self, backend, max_batch=32, max_latency=0.05):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.batches = 0
+        self.images = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name='batcher', daemon=True)
+        self._thread.start()
+
+
+    def submit(self, img_path):
+        future = Future()
+        self._queue.put((img_path, future))
+        self.backend.metrics.gauge('batcher_queue', self._queue.qsize())
+        with self.backend.metrics.timer('request'):
+            return future.result()
+
+
+    def _collect(self):
+        requests = [self._queue.get()]
+        size = len(requests[0][0])
+        deadline = time.monotonic() + self.max_latency
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+
+    def _loop(self):
+        while True:
+            requests = self._collect()
+            # clients asking for the same image share one forward pass
+            img_path = list(dict.fromkeys(path for paths, _ in requests for path in paths))
+            try:
+                results = self.backend.inference(img_path)
+            except Exception as e:
+                if len(requests) == 1:
+                    requests[0][1].set_exception(e)
+                    continue
+                # don't fail every client for one bad image, retry the requests one by one
+                for paths, future in requests:
+                    try:
+                        future.set_result(self.backend.inference(paths))
+                    except Exception as e:
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(img_path)
+            self.backend.metrics.gauge('coalesced_batch', len(img_path))
+            for paths, future in requests:
+                future.set_result({path: results[path] for path in paths})
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    # POST /inference {"paths": [...]} -> {path: {"pred": ..., "prob": ...}}
+    # POST /cam {"path": ...} -> {"binary": [[...]], "subtype": [[...]]}
+    # GET /info -> server configuration and batching counters
+    # GET /metrics -> the backend's stage timings, empty unless started with --metrics
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+        batcher = self.server.batcher
+        if self.path == '/metrics':
+            return self._reply(200, batcher.backend.metrics.snapshot())
+        if self.path != '/info':
+            return self._reply(404, {'error': f'unknown endpoint {self.path}'})
+        self._reply(200, {'reject_threshold': batcher.backend.reject_threshold, 'max_batch': batcher.max_batch,
+                          'max_latency': batcher.max_latency, 'batches': batcher.batches, 'images': batcher.images})
+
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if self.path == '/inference':
+                results = self.server.batcher.submit(request['paths'])
+                payload = {path: {'pred': result['pred'], 'prob': result['prob']} for path, result in results.items()}
+            elif self.path == '/cam':
+                cams = self.server.batcher.backend.compute_cam(request['path'])
+                payload = {task: cam.tolist() for task, cam in cams.items()}
+            else:
+                return self._reply(404, {'error': f'unknown endpoint {self.path}'})
+        except OSError as e:
+            return self._reply(404, {'error': str(e)})
+        except Exception as e:
+            return self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+        self._reply(200, payload)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(backend, host='127.0.0.1', port=8765, max_batch=32, max_latency=0.05):
+    server = ThreadingHTTPServer((host, port), InferenceHandler)
+    server.daemon_threads = True
+    server.batcher = DynamicBatcher(backend, max_batch, max_latency)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve one BackendModel to every local client, batching their requests together.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch', type=int, default=32, help='images per coalesced backend call')
+    parser.add_argument('--max-latency', type=float, default=0.05, help='seconds a request may wait for others to join its batch')
+    parser.add_argument('--reject-threshold', type=float, default=0.7)
+    parser.add_argument('--batch-size', type=int, default=None, help='defaults to the tuned value, else 4')
+    parser.add_argument('--num-workers', type=int, default=None, help='decode threads, defaults to the tuned value, else 4')
+    parser.add_argument('--cache', default=None, help='directory of the on-disk result cache, disabled if not given')
+    parser.add_argument('--metrics', action='store_true', help='record stage timings, served at GET /metrics')
+    args = parser.parse_args()
+
+    backend = BackendModel(reject_threshold=args.reject_threshold, batch_size=args.batch_size, num_workers=args.num_workers,
+                           cache=ResultCache(args.cache) if args.cache else None, cam_mode='lazy')
+    backend.warm_up()
+    backend.metrics.enable(args.metrics)
+    server = serve(backend, args.host, args.port, args.max_batch, args.max_latency)
+    print(f'serving on http://{args.host}:{args.port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
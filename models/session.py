@@ -0,0 +1,172 @@
+import json
+import os
+import numpy as np
+from models.base import LazyCAM
+from models.camstore import quantise_uint8
+from models.results import ResultStore
+
+# file layout: MAGIC, uint64 offset of the JSON header, 64-byte aligned array
+# sections, JSON header {name: [offset, dtype, shape]} at the end
+MAGIC = b'BCSESS01'
+ALIGN = 64
+TASKS = ['binary', 'subtype']
+
+
+class _Writer():
+
+    def __init__(self, f):
+        self.f = f
+        self.sections = {}
+
+    def _align(self):
+        padding = -self.f.tell() % ALIGN
+        self.f.write(b'\0' * padding)
+
+    def array(self, name, array):
+        self._align()
+        array = np.ascontiguousarray(array)
+        self.sections[name] = [self.f.tell(), array.dtype.str, list(array.shape)]
+        self.f.write(array.tobytes())
+
+
+def _saved_cams(cams):
+    # (binary, subtype) maps that exist without running the models, else None
+    if cams is None or (isinstance(cams, LazyCAM) and not cams.ready()):
+        return None
+    if cams['binary'] is None or cams['subtype'] is None:
+        return None
+    return cams['binary'], cams['subtype']
+
+
+def save_session(path, img_paths, results):
+    # Writes the imported image list and every result of the ResultStore,
+    # including manual overrides and uint8 CAMs, to `path`. CAMs not computed
+    # yet are left out and recomputed on demand after reopening.
+    # failed images are saved without result, so they are run again after reopening
+    rows = np.array([-1 if img_path in results.errors else results.row(img_path) for img_path in img_paths], dtype=np.int64)
+    encoded = [img_path.encode('utf-8') for img_path in img_paths]
+    path_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in encoded], out=path_offsets[1:])
+    cam_offsets = np.full((len(img_paths), 2), -1, dtype=np.int64)
+    cam_shapes = np.zeros((len(img_paths), 2, 2), dtype=np.int32)
+    cam_ranges = np.zeros((len(img_paths), 2, 2), dtype=np.float32)
+
+    try:
+        with open(path + '.tmp', 'wb') as f:
+            f.write(MAGIC + b'\0' * 8)
+            writer = _Writer(f)
+            writer.array('paths', np.frombuffer(b''.join(encoded), dtype=np.uint8))
+            writer.array('path_offsets', path_offsets)
+            has_result = rows >= 0
+            ids = rows[has_result]
+            for name in ['binary_pred', 'subtype_pred', 'binary_prob', 'subtype_prob', 'manual']:
+                column = getattr(results, name)
+                values = np.zeros((len(img_paths),) + column.shape[1:], dtype=column.dtype)
+                values[has_result] = column[ids]
+                writer.array(name, values)
+            writer.array('has_result', has_result.astype(np.uint8))
+            # CAM bytes are streamed, only their index is kept in memory
+            writer._align()
+            blob_start = f.tell()
+            for i, row in enumerate(rows):
+                cams = _saved_cams(results.cam(row)) if row >= 0 else None
+                if cams is None:
+                    continue
+                for t, cam in enumerate(cams):
+                    data, low, scale = quantise_uint8(cam)
+                    cam_offsets[i, t] = f.tell() - blob_start
+                    cam_shapes[i, t] = data.shape
+                    cam_ranges[i, t] = low, scale
+                    f.write(data.tobytes())
+            writer.sections['cams'] = [blob_start, '|u1', [f.tell() - blob_start]]
+            writer.array('cam_offsets', cam_offsets)
+            writer.array('cam_shapes', cam_shapes)
+            writer.array('cam_ranges', cam_ranges)
+            header_offset = f.tell()
+            f.write(json.dumps({'version': 1, 'count': len(img_paths), 'sections': writer.sections}).encode())
+            f.seek(len(MAGIC))
+            f.write(np.uint64(header_offset).tobytes())
+    except BaseException:
+        # e.g. the disk is full, the previous file at `path` stays as it was
+        if os.path.exists(path + '.tmp'):
+            os.remove(path + '.tmp')
+        raise
+    os.replace(path + '.tmp', path)
+
+
+def detach_session(results, cam_store=None):
+    # Copies whatever a ResultStore from load_session still reads from the
+    # session file into memory, CAMs into `cam_store` if given. The file is
+    # unmapped once the last reference is gone and can then be overwritten.
+    for name in ['binary_pred', 'subtype_pred', 'binary_prob', 'subtype_prob', 'manual']:
+        setattr(results, name, np.array(getattr(results, name)))
+    for path in results.paths:
+        cams = results.cam(results.row(path))
+        if isinstance(cams, SessionCAM):
+            cams = {task: cams[task] for task in TASKS}
+            results.set_cam(path, cam_store.handle(cams) if cam_store is not None else cams)
+
+
+class SessionCAM():
+    # Read-only {'binary': cam, 'subtype': cam} of a reopened session, read from
+    # the memory-mapped file (and so paged in) only when a map is shown.
+
+    def __init__(self, session, row):
+        self._session = session
+        self._row = row
+
+    def __getitem__(self, task):
+        return self._session.cam(self._row, TASKS.index(task))
+
+
+class Session():
+    # A session file mapped read-only. Prediction columns are copy-on-write
+    # views, so they can be edited without touching the file or reading it whole.
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a session file')
+            header_offset = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            f.seek(header_offset)
+            header = json.loads(f.read())
+        self.count = header['count']
+        self._file = np.memmap(path, dtype=np.uint8, mode='c')
+        self._sections = header['sections']
+
+    def array(self, name):
+        offset, dtype, shape = self._sections[name]
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        return self._file[offset:offset+size].view(dtype).reshape(shape)
+
+    def cam(self, row, task):
+        offset = int(self._cam_offsets[row, task])
+        if offset < 0:
+            return None
+        shape = tuple(self._cam_shapes[row, task])
+        low, scale = self._cam_ranges[row, task]
+        data = self._cams[offset:offset+shape[0]*shape[1]].reshape(shape)
+        return data.astype(np.float32) * scale + low
+
+    def load(self):
+        # (image paths in import order, ResultStore of the rows that had results)
+        blob = self.array('paths').tobytes()
+        offsets = self.array('path_offsets').tolist()
+        img_paths = [blob[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(self.count)]
+        self._cams = self.array('cams')
+        self._cam_offsets = self.array('cam_offsets')
+        self._cam_shapes = self.array('cam_shapes')
+        self._cam_ranges = self.array('cam_ranges')
+        rows = np.flatnonzero(self.array('has_result'))
+        # rows without saved CAMs get None, the GUI recomputes them on demand
+        cams = [SessionCAM(self, row) if self._cam_offsets[row, 0] >= 0 else None for row in rows]
+        columns = [self.array(name) for name in ['binary_pred', 'subtype_pred', 'binary_prob', 'subtype_prob', 'manual']]
+        if len(rows) < self.count:
+            columns = [column[rows] for column in columns]
+        results = ResultStore.from_arrays([img_paths[row] for row in rows], *columns, cams)
+        return img_paths, results
+
+
+def load_session(path):
+    return Session(path).load()
@@ -0,0 +1,134 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import itertools
+import multiprocessing
+import os
+import time
+from models.base import BaseBackendModel, LazyCAM
+
+# backend of the current worker process
+_backend = None
+
+
+def _init_worker(backend_class, backend_kwargs, num_threads, cpu_sets):
+    global _backend
+    import torch
+    if cpu_sets is not None:
+        # every worker takes its own slice of the cores
+        os.sched_setaffinity(0, cpu_sets.get())
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    _backend = backend_class(**backend_kwargs)
+    _backend.warm_up()
+
+
+def _worker_inference(img_path):
+    results = _backend.inference(img_path)
+    for result in results.values():
+        # lazy CAMs hold the worker's backend, the parent recreates them
+        if not isinstance(result['cam'], dict):
+            result['cam'] = None
+    return results
+
+
+def _worker_compute_cam(img_path):
+    return _backend.compute_cam(img_path)
+
+
+def _worker_pid(delay):
+    time.sleep(delay)
+    return os.getpid()
+
+
+class ShardedBackendModel(BaseBackendModel):
+    # Splits the path list into shards run by `num_processes` processes, each
+    # with its own backend and `threads_per_process` intra-op threads, instead of
+    # one process whose thread pool is too wide for batches of 4. With `pin`
+    # each worker is bound to a disjoint set of cores (Linux only).
+
+    def __init__(self, reject_threshold=0.7, num_processes=2, threads_per_process=None, pin=True, shard_size=16,
+                 backend_class=None, cam_store=None, **backend_kwargs):
+        super().__init__(reject_threshold)
+        if backend_class is None:
+            from models.inference import BackendModel
+            backend_class = BackendModel
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+        self.num_processes = num_processes
+        self.threads_per_process = threads_per_process or max(1, len(cpus) // num_processes)
+        self.shard_size = shard_size
+        self.cam_store = cam_store
+        self.cam_mode = backend_kwargs.get('cam_mode', 'eager')
+        backend_kwargs['reject_threshold'] = reject_threshold
+
+        context = multiprocessing.get_context('spawn')
+        cpu_sets = None
+        if pin and hasattr(os, 'sched_setaffinity') and num_processes * self.threads_per_process <= len(cpus):
+            cpu_sets = context.Queue()
+            for i in range(num_processes):
+                cpu_sets.put(cpus[i * self.threads_per_process:(i + 1) * self.threads_per_process])
+        self._pool = ProcessPoolExecutor(num_processes, mp_context=context, initializer=_init_worker,
+                                         initargs=(backend_class, backend_kwargs, self.threads_per_process, cpu_sets))
+
+
+    def warm_up(self):
+        # workers are spawned on demand and load their models at their own pace,
+        # keep the pool busy until every one of them has picked up a task
+        pids = set()
+        while len(pids) < self.num_processes:
+            pids.update(self._pool.map(_worker_pid, [0.1] * self.num_processes))
+        return sorted(pids)
+
+
+    def _merge(self, results):
+        for path, result in results.items():
+            if result['cam'] is None:
+                result['cam'] = LazyCAM(self, path)
+            elif self.cam_store is not None:
+                result['cam'] = self.cam_store.handle(result['cam'])
+        return results
+
+
+    def inference(self, img_path):
+        results = {}
+        for chunk in self.iter_inference(img_path, self.shard_size):
+            results.update(chunk)
+        return {path: results[path] for path in img_path}
+
+
+    def iter_inference(self, img_path, chunk_size=16):
+        # chunks are yielded as the workers finish them, not in input order.
+        # `img_path` may be any iterable, shards are pulled while fewer than two
+        # per worker are queued
+        # the stage timings of the workers stay in their processes, only shard round trips are measured here
+        img_path = iter(img_path)
+        futures = set()
+
+        def submit():
+            shard = list(itertools.islice(img_path, chunk_size))
+            if len(shard) > 0:
+                futures.add(self._pool.submit(_worker_inference, shard))
+            return len(shard) > 0
+
+        try:
+            while len(futures) < 2 * self.num_processes and submit():
+                pass
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    futures.remove(future)
+                    submit()
+                    self.metrics.gauge('shards_pending', len(futures))
+                    with self.metrics.timer('shard_merge'):
+                        results = self._merge(future.result())
+                    self.metrics.count('images', len(results))
+                    yield results
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+    def compute_cam(self, img_path):
+        return self._pool.submit(_worker_compute_cam, img_path).result()
+
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)